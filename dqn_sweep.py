@@ -1,49 +1,55 @@
 import argparse
+import glob
+import json
+import os
+import shutil
+import time
 
-from robotron2084gym.robotron import RobotronEnv
-from gym.wrappers import GrayScaleObservation, ResizeObservation
-from stable_baselines3.common.vec_env import DummyVecEnv, VecFrameStack
-from stable_baselines3.common.monitor import Monitor
+import numpy as np
+import torch
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecFrameStack
 from sb3_contrib import QRDQN
-from utils import WandBVideoRecorderWrapper
+from utils import FrameStackReplayBuffer, WandBVideoRecorderWrapper, load_checkpoint, make_vec_env, save_checkpoint
 from wandb.integration.sb3 import WandbCallback
 import wandb
 
+TOTAL_TIMESTEPS = 5_000_000
+ENV_CONFIG = {
+    "config_path": "game_config.yaml",
+    "level": 2,
+    "lives": 0,
+    "always_move": True,
+}
+# episodes at the end of a trial segment its score is averaged over
+SCORE_EPISODES = 100
+
 
 def main(args):
     device = "cuda:0"
-    total_timesteps = 5_000_000
-    env_config = {
-        "config_path": "game_config.yaml",
-        "level": 2,
-        "lives": 0,
-        "always_move": True,
-    }
+    env_config = ENV_CONFIG
 
     run = wandb.init(
         project="robotron",
-        config=args,
         sync_tensorboard=True,  # auto-upload sb3's tensorboard metrics
         monitor_gym=True,  # auto-upload the videos of agents playing the game
         save_code=True,  # optional
     )
     config = wandb.config
 
-    run.log({'env_config': env_config})
+    run.log({'env_config': env_config, 'num_envs': args.num_envs, 'seed': args.seed, 'levels': args.levels})
     run.log_code()
     run.log_code(name="game_config", include_fn=lambda x: x.endswith(".yaml"))
 
-    env = GrayScaleObservation(env, keep_dim=True)
-    env = ResizeObservation(env, (123, 166))
-    env = Monitor(env, info_keywords=('score', 'level'))
-    env = DummyVecEnv([lambda: env])
+    env = make_vec_env(env_config, num_envs=args.num_envs, seed=args.seed, levels=args.levels,
+                       info_keywords=('score', 'level'))
     env = WandBVideoRecorderWrapper(env, record_video_trigger=lambda x: x % 2000 == 0, video_length=200)
     env = VecFrameStack(env, 4, channels_order='first')
 
     env.reset()
     model = QRDQN(env=env, verbose=1, tensorboard_log=f"runs/{run.id}", device=device, **config)
     model.learn(
-        total_timesteps=total_timesteps,
+        total_timesteps=TOTAL_TIMESTEPS,
         callback=WandbCallback(
             gradient_save_freq=100,
             model_save_freq=500_000,
@@ -55,7 +61,86 @@ def main(args):
     run.finish()
 
 
+class TrialSegmentCallback(BaseCallback):
+    """
+    Stop training once the model reaches timesteps, and keep the score of every episode finished until then
+    """
+
+    def __init__(self, timesteps: int, verbose: int = 0):
+        super().__init__(verbose)
+        self.timesteps = timesteps
+        self.scores = []
+
+    def _on_step(self) -> bool:
+        for info in self.locals["infos"]:
+            episode = info.get("episode")
+            if episode is not None:
+                self.scores.append(episode.get("score", episode["r"]))
+        return self.num_timesteps < self.timesteps
+
+
+def trial(args):
+    """
+    Train one local sweep trial up to --timesteps without wandb, continuing from the checkpoint in --trial-dir if
+    there is one, then checkpoint it and write result.json for local_sweep.py.
+
+    Schedules run over --max-timesteps however many segments a trial is trained in, so a trial that is promoted
+    all the way trains the same as one full run.
+    """
+    torch.set_num_threads(args.threads)
+    start = time.time()
+    params = json.loads(args.params)
+    params.setdefault("replay_buffer_class", FrameStackReplayBuffer)
+    params.setdefault("replay_buffer_kwargs", {"frame_stack": 4})
+
+    env = make_vec_env(ENV_CONFIG, num_envs=args.num_envs, seed=args.seed, levels=args.levels,
+                       info_keywords=('score', 'level'))
+    env = VecFrameStack(env, 4, channels_order='first')
+    env.reset()
+
+    checkpoints = sorted(glob.glob(os.path.join(args.trial_dir, "checkpoint_*")),
+                         key=lambda checkpoint: int(checkpoint.rsplit("_", 1)[1]))
+    tensorboard_log = os.path.join(args.trial_dir, "runs")
+    if checkpoints:
+        model = load_checkpoint(checkpoints[-1], QRDQN, env=env, device=args.device, tensorboard_log=tensorboard_log,
+                                **params)
+    else:
+        model = QRDQN(env=env, verbose=1, tensorboard_log=tensorboard_log, device=args.device, seed=args.seed, **params)
+
+    segment = TrialSegmentCallback(args.timesteps)
+    model.learn(total_timesteps=args.max_timesteps - model.num_timesteps, callback=segment,
+                reset_num_timesteps=not checkpoints)
+
+    save_checkpoint(model, os.path.join(args.trial_dir, f"checkpoint_{model.num_timesteps}"))
+    for checkpoint in checkpoints:
+        shutil.rmtree(checkpoint, ignore_errors=True)
+
+    scores = segment.scores[-SCORE_EPISODES:]
+    with open(os.path.join(args.trial_dir, "result.json"), "w") as f:
+        json.dump({
+            "timesteps": model.num_timesteps,
+            "score": float(np.mean(scores)) if scores else None,
+            "episodes": len(segment.scores),
+            "seconds": time.time() - start,
+        }, f)
+    env.close()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument("--num-envs", type=int, default=1, help="envs stepped in parallel, one process each when > 1")
+    parser.add_argument("--seed", type=int, default=None, help="env i is seeded with seed + i")
+    parser.add_argument("--levels", type=int, nargs='+', default=None, help="starting level of each env, cycled")
+    # local sweep trials, started by local_sweep.py
+    parser.add_argument("--trial-dir", type=str, default=None,
+                        help="run one local sweep trial in this directory instead of a wandb sweep run")
+    parser.add_argument("--params", type=str, default="{}", help="trial QRDQN parameters as JSON")
+    parser.add_argument("--timesteps", type=int, default=TOTAL_TIMESTEPS, help="train the trial up to this many steps")
+    parser.add_argument("--max-timesteps", type=int, default=TOTAL_TIMESTEPS, help="timesteps schedules run over")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads for the trial")
+    parser.add_argument("--device", type=str, default="cpu", help="torch device for the trial")
     args = parser.parse_args()
-    main(args)
+    if args.trial_dir:
+        trial(args)
+    else:
+        main(args)
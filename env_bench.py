@@ -0,0 +1,234 @@
+"""
+HOW TO RUN THIS
+python env_bench.py                                   # default waves, stacks and env counts, writes env_bench.json
+python env_bench.py --waves 1 7 --envs 1 4 8 --steps 2000
+python env_bench.py --stacks raw play_area+monitor+frame_stack --baseline old_env_bench.json
+
+"""
+
+"""
+RobotronEnv Benchmarks
+
+Steps RobotronEnv uncapped (fps=0, no display) with random actions and measures how fast it goes, for each
+combination of:
+- wave, from config.yaml or any game config with --config
+- wrapper stack, layers joined with +, from raw RobotronEnv up to the train.py stack
+- number of parallel envs, one process each when more than one, like make_vec_env
+
+and reports env steps/sec (all envs together), the latency of one vec env step, and the peak RSS of this process
+and its env workers. Results are written as JSON. With --baseline, results slower than the baseline by more than
+--threshold are listed and the exit status is 1.
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import time
+
+import gymnasium as gym
+import numpy as np
+import psutil
+from gymnasium.wrappers import GrayScaleObservation, ResizeObservation
+from robotron2084gym.robotron import RobotronEnv
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecFrameStack
+
+from robotron_fsm import useHeadlessDisplay
+from utils import FrameSkip, PlayAreaObservation, load_play_area
+from utils.game_config import compile_config
+from utils.observation import OBSERVATION_SHAPE
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.yaml")
+OUTPUT_PATH = "env_bench.json"
+
+RAW = "raw"
+FRAME_STACK = "frame_stack"
+# per-env layers, applied in the order they are given
+LAYERS = {
+    "frame_skip": lambda env, config_path: FrameSkip(env, 4),
+    "grayscale": lambda env, config_path: GrayScaleObservation(env, keep_dim=True),
+    "resize": lambda env, config_path: ResizeObservation(env, OBSERVATION_SHAPE),
+    "play_area": lambda env, config_path: PlayAreaObservation(env, load_play_area(config_path)),
+    "monitor": lambda env, config_path: Monitor(env),
+}
+# each one adds a layer, or swaps grayscale+resize for the fused play_area, so the difference is its cost
+STACKS = [
+    RAW,
+    "grayscale",
+    "grayscale+resize",
+    "play_area",
+    "play_area+monitor",
+    "play_area+monitor+frame_stack",
+]
+PERCENTILES = (50, 90, 99)
+# steps between RSS samples
+RSS_EVERY = 50
+
+
+def parse_stack(stack: str) -> list:
+    """
+    "play_area+monitor+frame_stack" to its list of layers, checking the names. frame_stack can only be last,
+    it wraps the vec env.
+    """
+    layers = [] if stack == RAW else stack.split("+")
+    for i, layer in enumerate(layers):
+        if layer not in LAYERS and not (layer == FRAME_STACK and i == len(layers) - 1):
+            raise ValueError(f"Unknown layer {layer} in {stack}, layers are {', '.join(LAYERS)}, "
+                             f"and {FRAME_STACK} at the end")
+    return layers
+
+
+def build_env(env_config: dict, layers: list) -> gym.Env:
+    env = RobotronEnv(**env_config)
+    for layer in layers:
+        if layer != FRAME_STACK:
+            env = LAYERS[layer](env, env_config.get("config_path"))
+    return env
+
+
+def make_bench_env(env_config: dict, layers: list, num_envs: int):
+    env_fns = [functools.partial(build_env, env_config, layers) for _ in range(num_envs)]
+    env = DummyVecEnv(env_fns) if num_envs == 1 else SubprocVecEnv(env_fns)
+    if FRAME_STACK in layers:
+        env = VecFrameStack(env, 4, channels_order='first')
+    return env
+
+
+def tree_rss() -> int:
+    """
+    Resident bytes of this process and everything it started, env workers included
+    """
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def bench(env_config: dict, stack: str, num_envs: int, steps: int, warmup: int, seed: int) -> dict:
+    env = make_bench_env(env_config, parse_stack(stack), num_envs)
+    env.seed(seed)
+    env.action_space.seed(seed)
+    actions = np.array([[env.action_space.sample() for _ in range(num_envs)] for _ in range(warmup + steps)])
+    latencies = np.empty(steps)
+    try:
+        env.reset()
+        for action in actions[:warmup]:
+            env.step(action)
+
+        peak_rss = tree_rss()
+        start = time.perf_counter()
+        for i, action in enumerate(actions[warmup:]):
+            step_start = time.perf_counter()
+            env.step(action)
+            latencies[i] = time.perf_counter() - step_start
+            if i % RSS_EVERY == 0:
+                peak_rss = max(peak_rss, tree_rss())
+        elapsed = time.perf_counter() - start
+        peak_rss = max(peak_rss, tree_rss())
+    finally:
+        env.close()
+
+    result = {
+        "wave": env_config["level"],
+        "stack": stack,
+        "num_envs": num_envs,
+        "steps_per_sec": steps * num_envs / elapsed,
+        "peak_rss_mb": peak_rss / 2 ** 20,
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        result[f"p{percentile}_ms"] = float(value * 1000)
+    return result
+
+
+def result_name(result: dict) -> str:
+    return f"wave{result['wave']}/{result['stack']}/{result['num_envs']}env"
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """
+    Names of results whose steps/sec is lower than the baseline's by more than threshold
+    """
+    regressions = []
+    for result in results:
+        name = result_name(result)
+        if name in baseline and result["steps_per_sec"] < baseline[name]["steps_per_sec"] * (1 - threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main(config_path: str, waves: list, stacks: list, envs: list, steps: int, warmup: int, godmode: bool,
+         seed: int, output_path: str, baseline_path: str = None, threshold: float = 0.10, display: bool = False) -> int:
+    for stack in stacks:
+        parse_stack(stack)
+    wave_count = len(compile_config(config_path).waves)
+    for wave in waves:
+        if not 1 <= wave <= wave_count:
+            raise ValueError(f"{config_path} has waves 1 to {wave_count}, not {wave}")
+    if not display:
+        # inherited by the env workers
+        useHeadlessDisplay()
+
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = {result_name(result): result for result in json.load(f)["results"]}
+
+    print(f"{'Benchmark':<48} {'steps/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'RSS MB':>8} {'change':>8}")
+    results = []
+    for wave in waves:
+        env_config = {"config_path": config_path, "level": wave, "lives": 0, "fps": 0, "godmode": godmode,
+                      "always_move": True}
+        for stack in stacks:
+            for num_envs in envs:
+                result = bench(env_config, stack, num_envs, steps, warmup, seed)
+                results.append(result)
+                name = result_name(result)
+                line = (f"{name:<48} {result['steps_per_sec']:>9.1f} {result['p50_ms']:>8.2f} {result['p90_ms']:>8.2f} "
+                        f"{result['p99_ms']:>8.2f} {result['peak_rss_mb']:>8.0f}")
+                if name in baseline:
+                    line += f" {result['steps_per_sec'] / baseline[name]['steps_per_sec'] - 1:>+8.1%}"
+                print(line, flush=True)
+
+    with open(output_path, "w") as f:
+        json.dump({
+            "system": {"platform": platform.platform(), "python": platform.python_version(),
+                       "cpus": os.cpu_count()},
+            "settings": {"config": config_path, "steps": steps, "warmup": warmup, "godmode": godmode,
+                         "seed": seed},
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {output_path}")
+
+    regressions = compare(results, baseline, threshold)
+    if regressions:
+        print(f"Slower than the baseline by more than {threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='RobotronEnv throughput benchmarks')
+    parser.add_argument('--config', type=str, default=CONFIG_PATH, help='Game config with the waves')
+    parser.add_argument('--waves', type=int, nargs='+', default=[1, 5, 7], help='Waves to start each run on')
+    parser.add_argument('--stacks', type=str, nargs='+', default=STACKS,
+                        help=f'Wrapper stacks, layers joined with +: {", ".join(LAYERS)}, {FRAME_STACK} last, or {RAW}')
+    parser.add_argument('--envs', type=int, nargs='+', default=[1, 2, 4], help='Parallel env counts')
+    parser.add_argument('--steps', type=int, default=1000, help='Timed vec env steps per run')
+    parser.add_argument('--warmup', type=int, default=50, help='Untimed steps before each run')
+    parser.add_argument('--godmode', action='store_true', help='Player can not die, so runs stay on their wave longer')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the envs and the random actions')
+    parser.add_argument('--output', type=str, default=OUTPUT_PATH, help='JSON results file')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed slowdown before failing')
+    parser.add_argument('--display', action='store_true', help='Open the game window instead of running headless')
+    args = parser.parse_args()
+
+    sys.exit(main(args.config, args.waves, args.stacks, args.envs, args.steps, args.warmup, args.godmode,
+                  args.seed, args.output, args.baseline, args.threshold, args.display))
@@ -0,0 +1,292 @@
+"""
+HOW TO RUN THIS
+python evaluate.py --model qrdqn models/<run id>
+python evaluate.py --model qrdqn models/<run id>/checkpoint_500000 old_model.zip --waves 1 5 9 --seeds 0 1 2 3
+python evaluate.py --model qrdqn models/<run id> --watch 600 --workers 2 --cores 6 7    # next to train.py
+
+"""
+
+"""
+Checkpoint Evaluation
+
+Plays every checkpoint given, or every checkpoint and model zip in the directories given, for one game per seed
+and starting wave, with deterministic actions, in the env train.py trains on (one life, same preprocessing, frame
+skip given with --frame-skip). Games are spread over worker processes that all get their actions from one
+InferenceServer per checkpoint. Prints the score and wave reached statistics of each checkpoint.
+
+Results are cached in --cache, one JSON file per checkpoint and settings, named by a hash of the model file, the
+game config and the settings, so evaluating a directory again only plays the checkpoints that are new to it.
+
+To run next to training without slowing it down, give it spare cores with --cores and --workers to match, it also
+runs at a lower priority (--nice). With --watch it keeps checking the directories for new checkpoints, since
+train.py only keeps the newest ones.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+from robotron_fsm import useHeadlessDisplay
+from utils import InferenceServer, make_policy_env
+from utils.checkpoint import MODEL_FILE, list_checkpoints
+from utils.inference import MODEL_CLASSES, model_file, saved_data
+
+CACHE_DIR = "eval_cache"
+# read in chunks when hashing model files
+HASH_CHUNK = 1 << 20
+# seconds between checks that the workers and the inference server are still running
+RESULT_POLL = 5
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_models(paths: list) -> list:
+    """
+    Model files to evaluate: zips and checkpoint directories as they are, and for any other directory the
+    checkpoints and zips in it, oldest checkpoint first
+    """
+    models = []
+    for path in paths:
+        if os.path.isfile(path) or os.path.isfile(os.path.join(path, MODEL_FILE)):
+            models.append(model_file(path))
+        else:
+            models += [os.path.join(path, name, MODEL_FILE) for name in list_checkpoints(path)]
+            models += sorted(glob.glob(os.path.join(path, "*.zip")))
+    return models
+
+
+def cache_key(model_hash: str, settings: dict) -> str:
+    return hashlib.sha256((model_hash + json.dumps(settings, sort_keys=True)).encode()).hexdigest()
+
+
+def play_games(worker: int, client, observation_space, env_config: dict, frame_skip: int, max_steps: int, tasks,
+               results) -> None:
+    """
+    Worker process: play (wave, seed) games from tasks until it gets None, one env per starting wave
+    """
+    envs = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        wave, seed = task
+        if wave not in envs:
+            envs[wave] = make_policy_env(env_config, observation_space, level=wave, frame_skip=frame_skip)
+        env = envs[wave]
+        env.seed(seed)
+        obs = env.reset()
+
+        steps = 0
+        wave_reached = wave
+        while True:
+            obs, _, dones, infos = env.step(np.array([client.predict(obs[0])]))
+            steps += 1
+            wave_reached = max(wave_reached, int(infos[0]["level"]))
+            if dones[0] or steps >= max_steps:
+                break
+        results.put({"wave": wave, "seed": seed, "score": int(infos[0]["score"]), "wave_reached": wave_reached,
+                     "steps": steps, "finished": bool(dones[0])})
+
+    client.close()
+    for env in envs.values():
+        env.close()
+
+
+def summarize(episodes: list) -> dict:
+    """
+    Score and wave reached statistics over episodes, overall and per starting wave
+    """
+    def stats(games):
+        scores = np.array([game["score"] for game in games])
+        waves = np.array([game["wave_reached"] for game in games])
+        return {
+            "games": len(games),
+            "score_mean": float(scores.mean()),
+            "score_std": float(scores.std()),
+            "score_median": float(np.median(scores)),
+            "score_min": int(scores.min()),
+            "score_max": int(scores.max()),
+            "wave_mean": float(waves.mean()),
+            "wave_max": int(waves.max()),
+            "waves_cleared_mean": float(np.mean([game["wave_reached"] - game["wave"] for game in games])),
+        }
+
+    summary = stats(episodes)
+    summary["per_wave"] = {str(wave): stats([game for game in episodes if game["wave"] == wave])
+                           for wave in sorted({game["wave"] for game in episodes})}
+    return summary
+
+
+def check_running(processes: list, server: InferenceServer) -> None:
+    """
+    Raise if the inference server or a worker has died, or every worker has exited, since the games they had
+    would never be reported
+    """
+    crashed = [f"worker {worker} (exit code {process.exitcode})" for worker, process in enumerate(processes)
+               if not process.is_alive() and process.exitcode != 0]
+    if not server.process.is_alive():
+        crashed.append(f"inference server (exit code {server.process.exitcode})")
+    if crashed:
+        raise RuntimeError(f"Evaluation stopped, {', '.join(crashed)} died")
+    if not any(process.is_alive() for process in processes):
+        raise RuntimeError("Every worker exited without reporting all of its games")
+
+
+def evaluate(path: str, model_name: str, settings: dict, workers: int, max_wait: float) -> dict:
+    """
+    Play every (wave, seed) game of settings with the model at path, over workers processes sharing one
+    InferenceServer
+    """
+    observation_space = saved_data(path)["observation_space"]
+    env_config = {"config_path": settings["config_path"], "level": 1, "lives": 0, "fps": 0, "always_move": True}
+    games = [(wave, seed) for wave in settings["waves"] for seed in settings["seeds"]]
+    workers = min(workers, len(games))
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for game in games:
+        tasks.put(game)
+    for _ in range(workers):
+        tasks.put(None)
+
+    episodes = []
+    with InferenceServer(path, model_name, workers, max_wait=max_wait) as server:
+        processes = [multiprocessing.Process(target=play_games, daemon=True,
+                                             args=(worker, server.client(worker), observation_space, env_config,
+                                                   settings["frame_skip"], settings["max_steps"], tasks, results))
+                     for worker in range(workers)]
+        try:
+            for process in processes:
+                process.start()
+            while len(episodes) < len(games):
+                try:
+                    episodes.append(results.get(timeout=RESULT_POLL))
+                except queue.Empty:
+                    check_running(processes, server)
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+    episodes.sort(key=lambda game: (game["wave"], game["seed"]))
+    return {"episodes": episodes, "summary": summarize(episodes)}
+
+
+def evaluate_new(paths: list, model_name: str, settings: dict, cache_dir: str, workers: int, max_wait: float) -> list:
+    """
+    Evaluate every model found in paths that isn't cached yet, return the results of all of them
+    """
+    reports = []
+    for path in find_models(paths):
+        try:
+            model_hash = file_hash(path)
+            cache_path = os.path.join(cache_dir, cache_key(model_hash, settings) + ".json")
+            if os.path.exists(cache_path):
+                with open(cache_path) as f:
+                    report = json.load(f)
+            else:
+                start = time.perf_counter()
+                report = {
+                    "model": path,
+                    "model_hash": model_hash,
+                    "num_timesteps": saved_data(path).get("num_timesteps"),
+                    "settings": settings,
+                    **evaluate(path, model_name, settings, workers, max_wait),
+                }
+                report["seconds"] = time.perf_counter() - start
+                tmp_path = f"{cache_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(report, f, indent=2)
+                os.replace(tmp_path, cache_path)
+        except FileNotFoundError:
+            # train.py deletes older checkpoints as it writes new ones
+            print(f"{path} was removed before it could be evaluated")
+            continue
+        report["model"] = path
+        reports.append(report)
+    return reports
+
+
+def print_reports(reports: list) -> None:
+    print(f"{'Model':<60} {'steps':>10} {'games':>6} {'score':>8} {'median':>8} {'max':>8} {'wave':>6} {'max':>4}")
+    for report in reports:
+        summary = report["summary"]
+        steps = report["num_timesteps"] if report["num_timesteps"] is not None else ""
+        print(f"{report['model'][-60:]:<60} {steps:>10} {summary['games']:>6} {summary['score_mean']:>8.0f} "
+              f"{summary['score_median']:>8.0f} {summary['score_max']:>8} {summary['wave_mean']:>6.2f} "
+              f"{summary['wave_max']:>4}", flush=True)
+
+
+def main(paths: list, model_name: str, config_path: str, waves: list, seeds: list, frame_skip: int, max_steps: int,
+         workers: int, max_wait: float, cache_dir: str, cores: list, nice: int, watch: float, output_path: str):
+    # inherited by the inference server and every worker
+    if cores:
+        os.sched_setaffinity(0, cores)
+    if nice:
+        os.nice(nice)
+    useHeadlessDisplay()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    settings = {
+        "model_name": model_name,
+        "config_path": config_path,
+        "config_hash": file_hash(config_path) if config_path else None,
+        "waves": waves,
+        "seeds": seeds,
+        "frame_skip": frame_skip,
+        "max_steps": max_steps,
+        "deterministic": True,
+    }
+    seen = set()
+    while True:
+        reports = evaluate_new(paths, model_name, settings, cache_dir, workers, max_wait)
+        new = [report for report in reports if report["model_hash"] not in seen]
+        seen.update(report["model_hash"] for report in reports)
+        if new:
+            print_reports(new)
+        if output_path:
+            with open(output_path, "w") as f:
+                json.dump([{key: report[key] for key in ("model", "model_hash", "num_timesteps", "summary")}
+                           for report in reports], f, indent=2)
+        if not watch:
+            break
+        time.sleep(watch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate saved models over fixed seeds and starting waves')
+    parser.add_argument('paths', nargs='+', help='Model zips, checkpoint directories, or directories of them')
+    parser.add_argument('--model', choices=list(MODEL_CLASSES), required=True,
+                        help='Algorithm the models were trained with')
+    parser.add_argument('--config', type=str, default=None, help='Game config, the same one train.py used')
+    parser.add_argument('--waves', type=int, nargs='+', default=[1], help='Starting waves')
+    parser.add_argument('--seeds', type=int, nargs='+', default=list(range(10)), help='Seeds, one game each per wave')
+    parser.add_argument('--frame-skip', type=int, default=1, help='Same as train.py --frame-skip')
+    parser.add_argument('--max-steps', type=int, default=20_000, help='Cut a game off after this many actions')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Game worker processes')
+    parser.add_argument('--max-wait', type=float, default=0.002,
+                        help='Seconds the inference server waits for more requests to batch')
+    parser.add_argument('--cache', type=str, default=CACHE_DIR, help='Directory for cached results')
+    parser.add_argument('--cores', type=int, nargs='+', default=None, help='Only run on these CPU cores')
+    parser.add_argument('--nice', type=int, default=10, help='Added niceness, so training keeps priority')
+    parser.add_argument('--watch', type=float, default=0, help='Look for new checkpoints every this many seconds')
+    parser.add_argument('--output', type=str, default=None, help='Also write every summary to this JSON file')
+    args = parser.parse_args()
+
+    main(args.paths, args.model, args.config, args.waves, args.seeds, args.frame_skip, args.max_steps, args.workers,
+         args.max_wait, args.cache, args.cores, args.nice, args.watch, args.output)
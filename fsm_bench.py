@@ -0,0 +1,341 @@
+"""
+HOW TO RUN THIS
+python fsm_bench.py record                  # capture the board corpus, needs the game
+python fsm_bench.py record --no-game        # only the layout and synthetic sets
+python fsm_bench.py run --save-baseline     # measure and store the baseline for this machine
+python fsm_bench.py run                     # measure and compare against the baseline
+
+"""
+
+"""
+Robotron FSM Benchmarks
+
+Times the FSM decision loop on a fixed corpus of boards, so a change that slows it down shows up before it is used
+for training or evaluation.
+
+The corpus holds object lists captured from every wave in config.yaml, played by the FSM in godmode, the starting
+layout of every wave (its enemy and family counts placed at random), and synthetic worst cases with hundreds of
+projectiles around the player. It is written once with record, committed as fsm_corpus.json.gz and reused by run.
+
+Micro benchmarks time getDistance, getFireStick and getMoveStick over every object in a set of boards and report ns
+per object. Macro benchmarks time a whole decision per board for each chooseOutputs engine and choose_outputs_batch,
+and report µs per frame (and ns per object).
+
+run compares against a stored baseline and exits with status 1 when anything is slower by more than the threshold.
+Baselines are only comparable on the same machine, so fsm_baseline.json is not committed: save one on the machine
+that runs the comparison, before the change being measured.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from os import path
+import yaml
+import robotron_fsm as fsm
+from robotron2084gym.robotron import RobotronEnv
+
+CORPUS_PATH = path.join(path.dirname(__file__), "fsm_corpus.json.gz")
+BASELINE_PATH = path.join(path.dirname(__file__), "fsm_baseline.json")
+CONFIG_PATH = path.join(path.dirname(__file__), "config.yaml")
+
+WAVE_SET = "waves"
+LAYOUT_SET = "layouts"
+LAYOUTS_PER_WAVE = 5
+# object type of each column of the waves table in config.yaml
+WAVE_COLUMN_TYPES = ['Grunt', 'Electrode', 'Hulk', 'Brain', 'Sphereoid', 'Quark', 'Mommy', 'Daddy', 'Mikey']
+NS_PER_OBJECT = "ns/object"
+US_PER_FRAME = "us/frame"
+
+# name: (boards, projectiles, other objects)
+SYNTHETIC_SETS = {
+    "projectiles-100": (50, 100, 20),
+    "projectiles-300": (50, 300, 20),
+    "projectiles-600": (20, 600, 40),
+    "crowd-500": (20, 100, 400),
+}
+SYNTHETIC_NEAR = 150  # half of the projectiles land within this distance of the player
+
+
+"""
+Play each wave in godmode with the FSM and keep every Nth object list, until frames boards are kept or the wave ends.
+Return the boards, one list per wave.
+"""
+
+
+def recordWaves(waves, frames, every):
+    recorded = []
+    fsm.useHeadlessDisplay()
+    for wave in waves:
+        env = RobotronEnv(level=wave, lives=0, fps=0, config_path=CONFIG_PATH, godmode=True)
+        fsm.setBoardSize(env.get_board_size())
+        env.reset()
+        _, _, isDead, truncated, data = env.step(0)
+        boards = []
+        step = 0
+        while len(boards) < frames and data["level"] == wave and not (isDead or truncated):
+            if step % every == 0:
+                boards.append([list(obj) for obj in data["data"]])
+            actionArray = fsm.chooseOutputs(data["data"])
+            _, _, isDead, truncated, data = env.step(actionArray[0] * 9 + actionArray[1])
+            step += 1
+        env.close()
+        recorded.append(boards)
+        print(f"Wave {wave}: {len(boards)} boards")
+    return recorded
+
+
+"""
+Boards with the player first and the rest placed at random, in screen coordinates like the env.
+"""
+
+
+def syntheticBoards(count, projectiles, others, seed):
+    rng = random.Random(seed)
+    projectileTypes = sorted(fsm.PROJECTILES)
+    otherTypes = sorted(fsm.FAMILY | fsm.ENEMIES | fsm.CHASE_ENEMIES | fsm.PRIORITY_ENEMIES) + [
+        fsm.HULK, fsm.OBSTACLE, fsm.BULLET]
+    boards = []
+    for _ in range(count):
+        playerX = rng.randint(0, fsm.MAX_RIGHT)
+        playerY = rng.randint(0, fsm.MAX_TOP)
+        board = [[playerX, playerY, fsm.PLAYER]]
+        for index in range(projectiles):
+            if index % 2:
+                x = rng.randint(0, fsm.MAX_RIGHT)
+                y = rng.randint(0, fsm.MAX_TOP)
+            else:
+                x = min(max(playerX + rng.randint(-SYNTHETIC_NEAR, SYNTHETIC_NEAR), 0), fsm.MAX_RIGHT)
+                y = min(max(playerY + rng.randint(-SYNTHETIC_NEAR, SYNTHETIC_NEAR), 0), fsm.MAX_TOP)
+            board.append([x, y, rng.choice(projectileTypes)])
+        for _ in range(others):
+            board.append([rng.randint(0, fsm.MAX_RIGHT), rng.randint(0, fsm.MAX_TOP), rng.choice(otherTypes)])
+        boards.append(board)
+    return boards
+
+
+"""
+Boards with each wave's enemies and family from config.yaml, as many of each as the wave starts with, placed at random
+around a random player. Stands in for what the waves look like when the game isn't there to record them.
+"""
+
+
+def waveLayouts(waveCounts, count, seed):
+    rng = random.Random(seed)
+    boards = []
+    for counts in waveCounts:
+        for _ in range(count):
+            board = [[rng.randint(0, fsm.MAX_RIGHT), rng.randint(0, fsm.MAX_TOP), fsm.PLAYER]]
+            for objType, objCount in zip(WAVE_COLUMN_TYPES, counts):
+                for _ in range(objCount):
+                    board.append([rng.randint(0, fsm.MAX_RIGHT), rng.randint(0, fsm.MAX_TOP), objType])
+            boards.append(board)
+    return boards
+
+
+def record(corpus_path, frames, every, seed, game):
+    with open(CONFIG_PATH) as f:
+        waveCounts = yaml.safe_load(f)["waves"]
+    recorded = recordWaves(range(1, len(waveCounts) + 1), frames, every) if game else []
+    synthetic = {LAYOUT_SET: waveLayouts(waveCounts, LAYOUTS_PER_WAVE, seed)}
+    for index, (name, sizes) in enumerate(SYNTHETIC_SETS.items(), 1):
+        synthetic[name] = syntheticBoards(*sizes, seed=seed + index)
+    corpus = {
+        "board_size": [fsm.MAX_RIGHT, fsm.MAX_TOP],
+        "waves": recorded,
+        "synthetic": synthetic,
+    }
+    with gzip.open(corpus_path, "wt") as f:
+        json.dump(corpus, f, separators=(",", ":"))
+    print(f"Wrote {sum(map(len, recorded))} wave boards and {len(synthetic)} synthetic sets to {corpus_path}")
+
+
+"""
+Return {set name: boards}, with boards as lists of (objX, objY, objType) tuples like env.step returns.
+"""
+
+
+def loadCorpus(corpus_path):
+    with gzip.open(corpus_path, "rt") as f:
+        corpus = json.load(f)
+    fsm.setBoardSize(corpus["board_size"])
+    sets = {}
+    """ a corpus recorded without the game has no captured waves """
+    if corpus["waves"]:
+        sets[WAVE_SET] = [[tuple(obj) for obj in board] for boards in corpus["waves"] for board in boards]
+    for name, boards in corpus["synthetic"].items():
+        sets[name] = [[tuple(obj) for obj in board] for board in boards]
+    return sets
+
+
+"""
+Smallest time in ns of repeat calls to function
+"""
+
+
+def bestTime(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        function()
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+"""
+Every object other than the player, as (playerLocation, objX, objY) with the Y axis flipped like chooseOutputs does
+"""
+
+
+def objectCases(boards):
+    cases = []
+    for board in boards:
+        if not board or board[0][fsm.TYPE] != fsm.PLAYER:
+            continue
+        playerLocation = [board[0][fsm.X_POS], fsm.Y_AXIS_INVERSION - board[0][fsm.Y_POS]]
+        for objX, objY, objType in board[1:]:
+            cases.append((playerLocation, objX, fsm.Y_AXIS_INVERSION - objY))
+    return cases
+
+
+def microBenchmarks(boards, repeat):
+    cases = objectCases(boards)
+    distances = [(playerLocation, fsm.getDistance(playerLocation, objX, objY)) for playerLocation, objX, objY in cases]
+    getDistance = fsm.getDistance
+    getFireStick = fsm.getFireStick
+    getMoveStick = fsm.getMoveStick
+
+    def runDistance():
+        for playerLocation, objX, objY in cases:
+            getDistance(playerLocation, objX, objY)
+
+    def runFireStick():
+        for playerLocation, distance in distances:
+            getFireStick(distance)
+
+    def runMoveStick():
+        for playerLocation, distance in distances:
+            getMoveStick(distance, fsm.TOWARD, playerLocation)
+            getMoveStick(distance, fsm.AWAY, playerLocation)
+
+    results = {}
+    for name, function, calls in [("getDistance", runDistance, len(cases)),
+                                  ("getFireStick", runFireStick, len(cases)),
+                                  ("getMoveStick", runMoveStick, 2 * len(cases))]:
+        results[name] = {NS_PER_OBJECT: bestTime(function, repeat) / max(calls, 1)}
+    return results
+
+
+def macroBenchmarks(boards, repeat):
+    objects = max(sum(map(len, boards)), 1)
+    frames = max(len(boards), 1)
+    results = {}
+    for engine, chooseOutputs in fsm.CHOOSE_OUTPUTS_ENGINES.items():
+        def runEngine():
+            for board in boards:
+                chooseOutputs(board)
+        elapsed = bestTime(runEngine, repeat)
+        results[f"chooseOutputs[{engine}]"] = {US_PER_FRAME: elapsed / frames / 1000, NS_PER_OBJECT: elapsed / objects}
+    elapsed = bestTime(lambda: fsm.choose_outputs_batch(boards), repeat)
+    results["choose_outputs_batch"] = {US_PER_FRAME: elapsed / frames / 1000, NS_PER_OBJECT: elapsed / objects}
+    return results
+
+
+"""
+Every engine has to agree with chooseOutputs, or the timings don't mean anything
+"""
+
+
+def checkEngines(boards):
+    expected = [list(fsm.chooseOutputs(board)) for board in boards]
+    mismatches = []
+    for engine, chooseOutputs in fsm.CHOOSE_OUTPUTS_ENGINES.items():
+        if [list(chooseOutputs(board)) for board in boards] != expected:
+            mismatches.append(engine)
+    if fsm.choose_outputs_batch(boards).tolist() != expected:
+        mismatches.append("batch")
+    return mismatches
+
+
+"""
+A result regresses when its main unit (us/frame if it has one, else ns/object) is slower than the baseline by more
+than threshold. Return the list of regressed names.
+"""
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        unit = US_PER_FRAME if US_PER_FRAME in result else NS_PER_OBJECT
+        if result[unit] > baseline[name][unit] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def run(corpus_path, baseline_path, threshold, repeat, save_baseline):
+    sets = loadCorpus(corpus_path)
+    results = {}
+    for setName, boards in sets.items():
+        mismatches = checkEngines(boards)
+        if mismatches:
+            print(f"Engines disagree with chooseOutputs on {setName}: {', '.join(mismatches)}")
+            return 1
+        for name, result in {**microBenchmarks(boards, repeat), **macroBenchmarks(boards, repeat)}.items():
+            results[f"{name}/{setName}"] = result
+
+    baseline = {}
+    if not save_baseline and path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    print(f"{'Benchmark':<40} {US_PER_FRAME:>10} {NS_PER_OBJECT:>10} {'baseline':>10} {'change':>8}")
+    for name, result in results.items():
+        unit = US_PER_FRAME if US_PER_FRAME in result else NS_PER_OBJECT
+        perFrame = f"{result[US_PER_FRAME]:>10.1f}" if US_PER_FRAME in result else f"{'':>10}"
+        line = f"{name:<40} {perFrame} {result[NS_PER_OBJECT]:>10.1f}"
+        if name in baseline:
+            line += f" {baseline[name][unit]:>10.1f} {result[unit] / baseline[name][unit] - 1:>+8.1%}"
+        print(line)
+
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote baseline to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline, threshold)
+    if regressions:
+        print(f"Slower than the baseline by more than {threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='FSM benchmarks')
+    parser.add_argument('--corpus', type=str, default=CORPUS_PATH, help='Board corpus file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recordParser = commands.add_parser('record', help='Capture the board corpus from the game')
+    recordParser.add_argument('--frames', type=int, default=200, help='Boards kept per wave')
+    recordParser.add_argument('--every', type=int, default=5, help='Keep every Nth frame')
+    recordParser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic boards')
+    recordParser.add_argument('--no-game', action='store_true',
+                              help='Skip capturing waves from the game, only write the layout and synthetic sets')
+
+    runParser = commands.add_parser('run', help='Run the benchmarks against the corpus')
+    runParser.add_argument('--baseline', type=str, default=BASELINE_PATH, help='Baseline file')
+    runParser.add_argument('--threshold', type=float, default=0.10, help='Allowed slowdown before failing')
+    runParser.add_argument('--repeat', type=int, default=5, help='Timing runs, the fastest is kept')
+    runParser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.corpus, args.frames, args.every, args.seed, not args.no_game)
+    else:
+        sys.exit(run(args.corpus, args.baseline, args.threshold, args.repeat, args.save_baseline))
@@ -0,0 +1,170 @@
+"""
+HOW TO RUN THIS
+python fsm_demos.py --workers 8 --shards 64 --output demos/
+python fsm_demos.py --levels 1 3 5 7 --frame-skip 4 --output demos_skip4/
+python fsm_demos.py --observation objects --output demos_objects/
+python train.py --model qrdqn --demos demos/ --bc-epochs 1
+
+"""
+
+"""
+Robotron FSM Demonstrations
+
+Records the FSM playing, as training data for train.py: either to fill the QRDQN replay buffer before training
+starts, instead of acting randomly for learning_starts steps, or to clone the FSM's actions into the policy first.
+
+Games are played over a process pool with the same env train.py uses (same preprocessing, lives, always_move and
+frame skip), and the FSM's decision is stored as the same move * 9 + fire action. Each task plays games_per_shard
+games and writes them to one compressed shard, so nothing is gathered in the main process. A manifest with the
+settings the demonstrations were recorded with is written at the end, train.py checks the frame skip and
+observation against it.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import numpy as np
+import robotron_fsm
+from utils import OBSERVATION_PIXELS, OBSERVATIONS, make_env
+from utils.demonstrations import MANIFEST_FILE, write_shard
+
+# Per-worker state, set up once by initWorker in each pool process, envs are made the first time a level is played
+WORKER_ENV_CONFIG = None
+WORKER_FRAME_SKIP = 1
+WORKER_OBSERVATION = OBSERVATION_PIXELS
+WORKER_ENVS = {}
+WORKER_CHOOSE_OUTPUTS = None
+
+
+# Same as the env section of the train.py config
+def envConfig(configPath):
+    return {"config_path": configPath, "level": 1, "lives": 0, "fps": 0, "always_move": True}
+
+
+"""
+Pool initializer, runs once in each worker process
+"""
+
+
+def initWorker(configPath, frameSkip, observation, engine):
+    global WORKER_ENV_CONFIG, WORKER_FRAME_SKIP, WORKER_OBSERVATION, WORKER_CHOOSE_OUTPUTS
+
+    robotron_fsm.useHeadlessDisplay()
+    WORKER_ENV_CONFIG = envConfig(configPath)
+    WORKER_FRAME_SKIP = frameSkip
+    WORKER_OBSERVATION = observation
+    WORKER_CHOOSE_OUTPUTS = robotron_fsm.CHOOSE_OUTPUTS_ENGINES[engine]
+
+
+def workerEnv(level):
+    if level not in WORKER_ENVS:
+        WORKER_ENVS[level] = make_env(WORKER_ENV_CONFIG, level=level, frame_skip=WORKER_FRAME_SKIP,
+                                      observation=WORKER_OBSERVATION)()
+        robotron_fsm.setBoardSize(WORKER_ENVS[level].unwrapped.get_board_size())
+    return WORKER_ENVS[level]
+
+
+"""
+Play one game from level until game over or maxSteps actions.
+Return (frames, actions, rewards, terminated, score), frames has one more observation than there are actions.
+"""
+
+
+def playEpisode(level, seed, maxSteps):
+    env = workerEnv(level)
+    chooseOutputs = WORKER_CHOOSE_OUTPUTS
+
+    obs, _ = env.reset(seed=seed)
+    frames = [np.array(obs)]
+    actions = []
+    rewards = []
+    # the first action is taken blind, the object list only comes with a step
+    action = 0
+    while True:
+        obs, reward, terminated, truncated, data = env.step(action)
+        frames.append(np.array(obs))
+        actions.append(action)
+        rewards.append(reward)
+        if terminated or truncated or len(actions) >= maxSteps:
+            break
+        actionArray = chooseOutputs(data["data"])
+        action = actionArray[0] * 9 + actionArray[1]
+    return np.stack(frames), np.array(actions), np.array(rewards), bool(terminated), data["score"]
+
+
+"""
+task - (shard, seeds, levels, maxSteps, outputDir)
+Play one game per seed and level, and write them all to one shard. Return the shard's totals.
+"""
+
+
+def recordShard(task):
+    shard, seeds, levels, maxSteps, outputDir = task
+    episodes = []
+    scores = []
+    for seed, level in zip(seeds, levels):
+        frames, actions, rewards, terminated, score = playEpisode(level, seed, maxSteps)
+        episodes.append((frames, actions, rewards, terminated))
+        scores.append(score)
+
+    shardPath = os.path.join(outputDir, f"shard_{shard:05d}.npz")
+    write_shard(shardPath, episodes)
+    return {"shard": shard, "path": shardPath, "episodes": len(episodes),
+            "transitions": sum(len(actions) for _, actions, _, _ in episodes), "score": float(np.mean(scores))}
+
+
+def main(outputDir, configPath, levels, frameSkip, observation, engine, workers, shards, gamesPerShard, maxSteps,
+         seed):
+    os.makedirs(outputDir, exist_ok=True)
+    tasks = []
+    for shard in range(shards):
+        games = range(shard * gamesPerShard, (shard + 1) * gamesPerShard)
+        tasks.append((shard, [seed + game for game in games], [levels[game % len(levels)] for game in games],
+                      maxSteps, outputDir))
+
+    results = []
+    initArgs = (configPath, frameSkip, observation, engine)
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=initArgs) as pool:
+        for result in pool.imap_unordered(recordShard, tasks):
+            results.append(result)
+            print(f"Shard {result['shard']:>5}: {result['episodes']} games, {result['transitions']} steps, "
+                  f"mean score {result['score']:.0f}", flush=True)
+
+    results.sort(key=lambda result: result["shard"])
+    manifest = {
+        "config_path": configPath,
+        "levels": levels,
+        "frame_skip": frameSkip,
+        "observation": observation,
+        "engine": engine,
+        "max_steps": maxSteps,
+        "seed": seed,
+        "episodes": sum(result["episodes"] for result in results),
+        "transitions": sum(result["transitions"] for result in results),
+        "shards": results,
+    }
+    with open(os.path.join(outputDir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {manifest['transitions']} steps from {manifest['episodes']} games to {outputDir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Record FSM demonstrations for training')
+    parser.add_argument('--output', type=str, default='demos', help='Directory for the shards and manifest')
+    parser.add_argument('--config', type=str, default=None, help='Game config, the same one train.py uses')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1], help='Starting level of each game, cycled')
+    parser.add_argument('--frame-skip', type=int, default=1, help='Same as train.py --frame-skip')
+    parser.add_argument('--observation', choices=OBSERVATIONS, default=OBSERVATION_PIXELS,
+                        help='Same as train.py --observation')
+    parser.add_argument('--engine', choices=list(robotron_fsm.CHOOSE_OUTPUTS_ENGINES), default=robotron_fsm.ENGINE_NUMPY,
+                        help='chooseOutputs implementation')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--shards', type=int, default=16, help='Shards to write')
+    parser.add_argument('--games-per-shard', type=int, default=4, help='Games in each shard')
+    parser.add_argument('--max-steps', type=int, default=20_000, help='Cut a game off after this many actions')
+    parser.add_argument('--seed', type=int, default=0, help='Game i is played with seed + i')
+
+    args = parser.parse_args()
+    main(args.output, args.config, args.levels, args.frame_skip, args.observation, args.engine, args.workers,
+         args.shards, args.games_per_shard, args.max_steps, args.seed)
@@ -0,0 +1,199 @@
+"""
+Joystick directions and direction lookup tables for robotron_fsm
+
+getFireStick used to run atan2 and an if/elif ladder of radian ranges for every decision, and getMoveStick
+followed it with the wall and corner correction cascade. Both only depend on small integer inputs on a
+665x492 board, so the answers are computed once per board size and looked up afterwards:
+    octant table - fire direction for every (xDistance, yDistance) on the board
+    wall table   - corrected move direction for every (player region, direction, TOWARD/AWAY)
+"""
+
+import bisect
+import numpy as np
+
+# Joystick directions
+STAY = 0
+UP = 1
+UP_RIGHT = 2
+RIGHT = 3
+DOWN_RIGHT = 4
+DOWN = 5
+DOWN_LEFT = 6
+LEFT = 7
+UP_LEFT = 8
+DIRECTION_COUNT = 9
+
+# Move directives
+TOWARD = 1
+AWAY = 0
+DIRECTIVE_COUNT = 2
+
+# 45 degrees per segment, and negatives are possible. First match wins, same as the original if/elif ladder.
+POSITIVE_RADIANS = [
+    (0.392699081, RIGHT),  # 0 to 22.5
+    (1.178097245, UP_RIGHT),  # 22.5 to 67.5
+    (1.963495408, UP),  # 67.5 to 112.5
+    (2.748893572, UP_LEFT),  # 112.5 to 157.5
+    (3.534291735, LEFT),  # 157.5 to 202.5
+    (4.3196898899, DOWN_LEFT),  # 202.5 to 247.5
+    (5.105088062, DOWN),  # 247.5 to 292.5
+    (5.890486225, DOWN_RIGHT),  # 292.5 to 337.5
+]
+POSITIVE_RADIANS_LAST = 6.283185308  # 337.5 to 360 = RIGHT, inclusive
+NEGATIVE_RADIANS = [
+    (-0.392699081, RIGHT),  # 0 to -22.5
+    (-1.178097245, DOWN_RIGHT),  # -22.5 to -67.5
+    (-1.963495408, DOWN),  # -67.5 to -112.5
+    (-2.748893572, DOWN_LEFT),  # -112.5 to -157.5
+    (-3.53429173, LEFT),  # -157.5 to -202.5
+    (-4.3196898899, UP_LEFT),  # -202.5 to -247.5
+    (-5.105088062, UP),  # -247.5 to -292.5
+    (-5.890486225, UP_RIGHT),  # -292.5 to -337.5
+]
+NEGATIVE_RADIANS_LAST = -6.283185308  # -337.5 to -360 = RIGHT, inclusive
+
+
+"""
+xDistance, yDistance - numpy arrays of distances from the player, with the Y axis increasing upward
+Vectorized version of the original getFireStick math: atan2 and the radian ladder.
+Return an array of values from the Joystick Directions constants.
+"""
+
+
+def fireDirections(xDistance, yDistance):
+    xDistance = np.asarray(xDistance)
+    yDistance = np.asarray(yDistance)
+    radians = np.arctan2(yDistance, xDistance)
+
+    """ skip the math if one direction is 0 """
+    conditions = [xDistance == 0, yDistance == 0, radians == 0]
+    choices = [np.where(yDistance >= 0, UP, DOWN), np.where(xDistance >= 0, RIGHT, LEFT), RIGHT]
+    for bound, direction in POSITIVE_RADIANS:
+        conditions.append((radians > 0) & (radians < bound))
+        choices.append(direction)
+    conditions.append((radians > 0) & (radians <= POSITIVE_RADIANS_LAST))
+    choices.append(RIGHT)
+    for bound, direction in NEGATIVE_RADIANS:
+        conditions.append((radians < 0) & (radians > bound))
+        choices.append(direction)
+    conditions.append((radians < 0) & (radians >= NEGATIVE_RADIANS_LAST))
+    choices.append(RIGHT)
+
+    return np.select(conditions, choices, default=RIGHT)
+
+
+"""
+Reverse a joystick direction, for moving AWAY from a target.
+"""
+
+
+def reverseDirection(direction):
+    direction = (direction + 4) % 8
+    if direction == 0:
+        direction = 8
+    return direction
+
+
+"""
+values along one axis (0..limit) are grouped into regions, split at each breakpoint.
+A breakpoint is the first value that may behave differently from the value before it.
+Return the region of every value on the axis, and one representative value per region.
+"""
+
+
+def axisRegions(limit, breaks):
+    breaks = sorted(b for b in set(breaks) if 0 < b <= limit)
+    regions = bytes(bisect.bisect_right(breaks, value) for value in range(limit + 1))
+    return regions, [0] + breaks
+
+
+"""
+Lookup tables for one board size.
+
+boardSize - (MAX_RIGHT, MAX_TOP) from env.get_board_size()
+wallCorrection - function(moveDirection, playerLocation) returning the move direction corrected for walls
+    and corners. It is only called once per table entry, with a representative location for each region.
+xBreaks, yBreaks - player positions where wallCorrection may start returning something different
+"""
+
+
+class DirectionTables:
+    def __init__(self, boardSize, wallCorrection, xBreaks, yBreaks):
+        self.maxX, self.maxY = boardSize
+
+        """ octant table, indexed by (xDistance + maxX) * ySize + (yDistance + maxY) """
+        self.ySize = 2 * self.maxY + 1
+        xDistance, yDistance = np.meshgrid(np.arange(-self.maxX, self.maxX + 1),
+                                           np.arange(-self.maxY, self.maxY + 1), indexing='ij')
+        self.octantArray = fireDirections(xDistance, yDistance).astype(np.uint8)
+        self.octants = self.octantArray.tobytes()
+
+        """ wall table, indexed by ((xRegion * yRegionCount + yRegion) * DIRECTION_COUNT + direction) * DIRECTIVE_COUNT + directive """
+        self.xRegions, xSamples = axisRegions(self.maxX, xBreaks)
+        self.yRegions, ySamples = axisRegions(self.maxY, yBreaks)
+        self.yRegionCount = len(ySamples)
+        walls = []
+        for x in xSamples:
+            for y in ySamples:
+                for direction in range(DIRECTION_COUNT):
+                    walls.append(wallCorrection(reverseDirection(direction), [x, y]))  # AWAY
+                    walls.append(wallCorrection(direction, [x, y]))  # TOWARD
+        self.walls = bytes(walls)
+
+        """ the same tables as numpy arrays, for looking up a whole batch of targets at once """
+        self.xRegionArray = np.frombuffer(self.xRegions, dtype=np.uint8).astype(np.intp)
+        self.yRegionArray = np.frombuffer(self.yRegions, dtype=np.uint8).astype(np.intp)
+        self.wallArray = np.frombuffer(self.walls, dtype=np.uint8).astype(np.intp)
+
+    """
+    Fire direction toward a target at (xDistance, yDistance) from the player
+    """
+
+    def fireStick(self, xDistance, yDistance):
+        maxX = self.maxX
+        maxY = self.maxY
+        if -maxX <= xDistance <= maxX and -maxY <= yDistance <= maxY:
+            return self.octants[(xDistance + maxX) * self.ySize + yDistance + maxY]
+        """ off the board, so not in the table """
+        return int(fireDirections(xDistance, yDistance))
+
+    """
+    Move direction TOWARD or AWAY from a target at (xDistance, yDistance), corrected for walls and corners
+    """
+
+    def moveStick(self, xDistance, yDistance, moveDirective, playerX, playerY):
+        maxX = self.maxX
+        maxY = self.maxY
+        if -maxX <= xDistance <= maxX and -maxY <= yDistance <= maxY:
+            direction = self.octants[(xDistance + maxX) * self.ySize + yDistance + maxY]
+        else:
+            direction = int(fireDirections(xDistance, yDistance))
+        """ regions are the same past either edge of the board, so clamp onto it """
+        if not 0 <= playerX <= maxX:
+            playerX = 0 if playerX < 0 else maxX
+        if not 0 <= playerY <= maxY:
+            playerY = 0 if playerY < 0 else maxY
+        region = self.xRegions[playerX] * self.yRegionCount + self.yRegions[playerY]
+        return self.walls[(region * DIRECTION_COUNT + direction) * DIRECTIVE_COUNT + moveDirective]
+
+    """
+    Array version of fireStick, for numpy arrays of targets
+    """
+
+    def fireSticks(self, xDistance, yDistance):
+        directions = self.octantArray[np.clip(xDistance + self.maxX, 0, 2 * self.maxX),
+                                      np.clip(yDistance + self.maxY, 0, 2 * self.maxY)].astype(np.intp)
+        onBoard = (np.abs(xDistance) <= self.maxX) & (np.abs(yDistance) <= self.maxY)
+        if not onBoard.all():
+            directions = np.where(onBoard, directions, fireDirections(xDistance, yDistance))
+        return directions
+
+    """
+    Array version of moveStick. moveDirective can be a single value or an array.
+    """
+
+    def moveSticks(self, xDistance, yDistance, moveDirective, playerX, playerY):
+        directions = self.fireSticks(xDistance, yDistance)
+        region = (self.xRegionArray[np.clip(playerX, 0, self.maxX)] * self.yRegionCount
+                  + self.yRegionArray[np.clip(playerY, 0, self.maxY)])
+        return self.wallArray[(region * DIRECTION_COUNT + directions) * DIRECTIVE_COUNT + moveDirective]
@@ -0,0 +1,64 @@
+"""
+Columnar object frames for robotron_fsm
+
+The env sends each frame as a list of (x, y, 'Grunt') tuples. An ObjectFrame turns that into preallocated
+x, y and type id arrays once per frame, with the Y axis already flipped, so the FSM works on integer arrays instead
+of unpacking tuples and hashing type names for every object. categoryOf maps a type id straight to its FSM category:
+
+    frame.load(data["data"])
+    categories = frame.categoryOf[frame.typeId[:frame.count]]
+"""
+
+from itertools import repeat
+import numpy as np
+
+# Every object type the env sends. Anything else gets UNKNOWN_TYPE.
+OBJECT_TYPES = [
+    'Player', 'Bullet',
+    'Mommy', 'Daddy', 'Mikey',
+    'Grunt', 'Electrode', 'Hulk', 'Brain', 'Prog', 'CruiseMissile',
+    'Sphereoid', 'Enforcer', 'EnforcerBullet',
+    'Quark', 'Tank', 'TankShell',
+]
+TYPE_IDS = {name: typeId for typeId, name in enumerate(OBJECT_TYPES)}
+UNKNOWN_TYPE = len(OBJECT_TYPES)
+
+
+class ObjectFrame:
+    """
+    categoryCodes - FSM category for each type name, types not in it get skipCategory
+    yInversion - Y_AXIS_INVERSION, so 0 is at the bottom border like chooseOutputs
+    capacity - objects the arrays hold before they have to grow
+    """
+
+    def __init__(self, categoryCodes, skipCategory, yInversion, capacity=256):
+        self.categoryOf = np.array([categoryCodes.get(name, skipCategory) for name in OBJECT_TYPES] + [skipCategory],
+                                   dtype=np.intp)
+        self.yInversion = yInversion
+        self.count = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.x = np.zeros(capacity, dtype=np.int64)
+        self.y = np.zeros(capacity, dtype=np.int64)
+        self.typeId = np.zeros(capacity, dtype=np.intp)
+
+    """
+    objectList - array of objects with 3 values: objX, objY, objType
+    Fill the arrays from an env object list, growing them if it doesn't fit. Only the first count entries are valid.
+    Return the frame.
+    """
+
+    def load(self, objectList):
+        count = len(objectList)
+        if count > len(self.x):
+            self.allocate(max(count, 2 * len(self.x)))
+        self.count = count
+        if count:
+            xs, ys, types = zip(*objectList)
+            self.x[:count] = xs
+            y = self.y[:count]
+            y[:] = ys
+            np.subtract(self.yInversion, y, out=y)
+            self.typeId[:count] = list(map(TYPE_IDS.get, types, repeat(UNKNOWN_TYPE)))
+        return self
@@ -0,0 +1,116 @@
+"""
+Uniform spatial grid over the play field for robotron_fsm
+
+The FSM only reacts to objects near the player, but the object list covers the whole board. The grid buckets
+the object list by cell once per frame, so the FSM can measure objects ring by ring outward from the player's cell
+and stop as soon as the near field is covered and nothing closer can exist for any category it still needs.
+
+rebuild still visits every object, so building the grid is O(objects) each frame and only the distance checks are
+saved. The env sends a new list every frame with no object identity, so there is nothing to move incrementally.
+See chooseOutputsGrid for where it beats the other engines.
+"""
+
+
+class SpatialGrid:
+    def __init__(self, boardSize, cellSize, categoryCount):
+        self.maxX, self.maxY = boardSize
+        self.cellSize = cellSize
+        self.columns = self.maxX // cellSize + 1
+        self.rows = self.maxY // cellSize + 1
+        self.categoryCount = categoryCount
+        self.buckets = [[] for _ in range(self.columns * self.rows)]
+        """ bucket offset of every X and Y position on the board, positions are whole pixels """
+        self.cellOfX = [x // cellSize * self.rows for x in range(self.maxX + 1)]
+        self.cellOfY = [y // cellSize for y in range(self.maxY + 1)]
+        self.last = [None] * categoryCount
+
+    """
+    objectList - array of objects with 3 values: objX, objY, objType
+    categoryCodes - category for each objType. Objects of any other type are left out.
+    yInversion - the Y axis is flipped so 0 is at the bottom, same as chooseOutputs
+    Bucket entries are (category, index, objX, objY), with index the position in objectList.
+    Also keeps the last entry of each category in list order, None for categories not on the board.
+    """
+
+    def rebuild(self, objectList, categoryCodes, yInversion):
+        for bucket in self.buckets:
+            bucket.clear()
+        last = [None] * self.categoryCount
+        buckets = self.buckets
+        cellOfX = self.cellOfX
+        cellOfY = self.cellOfY
+        maxX = self.maxX
+        maxY = self.maxY
+        getCategory = categoryCodes.get
+
+        for index, (objX, objY, objType) in enumerate(objectList):
+            category = getCategory(objType)
+            if category is None:
+                continue
+            objY = yInversion - objY
+            entry = (category, index, objX, objY)
+            if 0 <= objX <= maxX and 0 <= objY <= maxY:
+                buckets[cellOfX[objX] + cellOfY[objY]].append(entry)
+            else:
+                """ objects past the edge go in the border cells """
+                column, row = self.cell(objX, objY)
+                buckets[column * self.rows + row].append(entry)
+            last[category] = entry
+
+        self.last = last
+
+    """
+    Cell column and row of a position, clamped onto the board
+    """
+
+    def cell(self, x, y):
+        column = min(max(int(x), 0), self.maxX) // self.cellSize
+        row = min(max(int(y), 0), self.maxY) // self.cellSize
+        return column, row
+
+    """
+    Lower bound on the distance from (x, y), in cell (column, row), to anything in ring cells or further away.
+    Sides where the rings inside it already reach the edge of the board have nothing left on them.
+    Return None when no cells are left at all.
+    """
+
+    def ringDistance(self, x, y, column, row, ring):
+        gaps = []
+        if column - ring >= 0:
+            gaps.append(x - (column - ring + 1) * self.cellSize)
+        if column + ring < self.columns:
+            gaps.append((column + ring) * self.cellSize - x)
+        if row - ring >= 0:
+            gaps.append(y - (row - ring + 1) * self.cellSize)
+        if row + ring < self.rows:
+            gaps.append((row + ring) * self.cellSize - y)
+        return min(gaps) if gaps else None
+
+    """
+    Largest ring around (column, row) that still has cells on the board
+    """
+
+    def maxRing(self, column, row):
+        return max(column, self.columns - 1 - column, row, self.rows - 1 - row)
+
+    """
+    Buckets of the cells exactly ring cells away from (column, row), skipping cells off the board
+    """
+
+    def ring(self, column, row, ring):
+        if ring == 0:
+            return [self.buckets[column * self.rows + row]]
+        cells = []
+        firstRow = max(row - ring, 0)
+        lastRow = min(row + ring, self.rows - 1)
+        for ringColumn in range(max(column - ring, 0), min(column + ring, self.columns - 1) + 1):
+            offset = ringColumn * self.rows
+            if ringColumn == column - ring or ringColumn == column + ring:
+                for ringRow in range(firstRow, lastRow + 1):
+                    cells.append(self.buckets[offset + ringRow])
+            else:
+                if row - ring >= 0:
+                    cells.append(self.buckets[offset + row - ring])
+                if row + ring < self.rows:
+                    cells.append(self.buckets[offset + row + ring])
+        return cells
@@ -0,0 +1,190 @@
+"""
+HOW TO RUN THIS
+python fsm_runner.py --workers 8 --games 25
+python fsm_runner.py --level 10 --lives 0 --games 50 --results results.jsonl
+
+"""
+
+"""
+Robotron FSM Runner
+
+robotron_fsm.py plays one game forever, which is fine for watching but not for telling whether a change to the
+FSM helped. This plays many games at once over a process pool, with one RobotronEnv per worker, and prints each
+game as it finishes. When every game is done it prints a wave-by-wave table: how many games reached each wave,
+how many cleared it or died on it, and the average score, frames and family saved on that wave.
+
+Games end on death (game over), or after max_frames so godmode games still finish.
+"""
+
+import argparse
+import json
+import multiprocessing
+from os import path
+import robotron_fsm
+from robotron2084gym.robotron import RobotronEnv
+
+# Smallest family score in config.yaml. Family remaining also drops when a Hulk or Brain gets one, but that
+# scores nothing, so only drops that come with at least this much score count as saved.
+FAMILY_RESCUE_SCORE = 1000
+
+# Per-worker state, set up once by initWorker in each pool process
+WORKER_ENV = None
+WORKER_CHOOSE_OUTPUTS = None
+
+
+"""
+Pool initializer, runs once in each worker process
+"""
+
+
+def initWorker(starting_level, lives, godmode, engine):
+    global WORKER_ENV, WORKER_CHOOSE_OUTPUTS
+
+    robotron_fsm.useHeadlessDisplay()
+    config_path = path.join(path.dirname(__file__), "config.yaml")
+    WORKER_ENV = RobotronEnv(level=starting_level, lives=lives, fps=0, config_path=config_path, godmode=godmode)
+    robotron_fsm.setBoardSize(WORKER_ENV.get_board_size())
+    WORKER_CHOOSE_OUTPUTS = robotron_fsm.CHOOSE_OUTPUTS_ENGINES[engine]
+
+
+def newWave(level):
+    return {"level": level, "score": 0, "frames": 0, "family_saved": 0, "cleared": False}
+
+
+"""
+task - (game, seed, max_frames)
+Play one game in this worker's env until game over or max_frames.
+Return the game totals plus one entry per wave played.
+"""
+
+
+def playGame(task):
+    game, seed, max_frames = task
+    env = WORKER_ENV
+    chooseOutputs = WORKER_CHOOSE_OUTPUTS
+
+    env.reset(seed=seed)
+    _, _, isDead, truncated, data = env.step(0)
+    frames = 1
+    score = data["score"]
+    family = data["family"]
+    wave = newWave(data["level"])
+    wave["frames"] = 1
+    waves = [wave]
+
+    while not (isDead or truncated) and frames < max_frames:
+        actionArray = chooseOutputs(data["data"])
+        _, _, isDead, truncated, data = env.step(actionArray[0] * 9 + actionArray[1])
+        frames += 1
+
+        if data["level"] != wave["level"]:
+            wave["cleared"] = True
+            wave = newWave(data["level"])
+            waves.append(wave)
+        elif data["family"] < family and data["score"] - score >= FAMILY_RESCUE_SCORE:
+            wave["family_saved"] += family - data["family"]
+        wave["score"] += data["score"] - score
+        wave["frames"] += 1
+        score = data["score"]
+        family = data["family"]
+
+    return {
+        "game": game,
+        "seed": seed,
+        "score": score,
+        "level": wave["level"],
+        "frames": frames,
+        "family_saved": sum(w["family_saved"] for w in waves),
+        "died": bool(isDead),
+        "waves": waves,
+    }
+
+
+"""
+results - game results from playGame
+Return one row per wave, in wave order, with counts and per-wave averages over the games that reached it.
+"""
+
+
+def summarize(results):
+    totals = {}
+    for result in results:
+        for wave in result["waves"]:
+            row = totals.setdefault(wave["level"], {"level": wave["level"], "games": 0, "cleared": 0, "died": 0,
+                                                    "score": 0, "frames": 0, "family_saved": 0})
+            row["games"] += 1
+            row["cleared"] += wave["cleared"]
+            row["score"] += wave["score"]
+            row["frames"] += wave["frames"]
+            row["family_saved"] += wave["family_saved"]
+        if result["died"]:
+            totals[result["level"]]["died"] += 1
+
+    rows = []
+    for level in sorted(totals):
+        row = totals[level]
+        games = row["games"]
+        rows.append({
+            "level": level,
+            "games": games,
+            "cleared": row["cleared"],
+            "died": row["died"],
+            "survival": row["cleared"] / games,
+            "score": row["score"] / games,
+            "frames": row["frames"] / games,
+            "family_saved": row["family_saved"] / games,
+        })
+    return rows
+
+
+def printTable(rows):
+    print(f"{'Wave':>4} {'Games':>6} {'Cleared':>8} {'Died':>6} {'Survival':>9} {'Score':>9} {'Frames':>8} {'Family':>7}")
+    for row in rows:
+        print(f"{row['level']:>4} {row['games']:>6} {row['cleared']:>8} {row['died']:>6} {row['survival']:>9.1%} "
+              f"{row['score']:>9.0f} {row['frames']:>8.0f} {row['family_saved']:>7.2f}")
+
+
+def main(starting_level: int = 1, lives: int = 3, godmode: bool = False, workers: int = 0, games: int = 10,
+         engine: str = robotron_fsm.ENGINE_PYTHON, max_frames: int = 100000, seed: int = 0, results_path: str = None):
+    workers = workers or multiprocessing.cpu_count()
+    tasks = [(game, seed + game, max_frames) for game in range(workers * games)]
+    results = []
+    resultsFile = open(results_path, "w") if results_path else None
+
+    try:
+        with multiprocessing.Pool(workers, initializer=initWorker,
+                                  initargs=(starting_level, lives, godmode, engine)) as pool:
+            """ one game per task, so results come back as soon as each game ends """
+            for result in pool.imap_unordered(playGame, tasks):
+                results.append(result)
+                print(f"Game {result['game']:>4} | Score: {result['score']:>8} | Level: {result['level']:>3} | "
+                      f"Frames: {result['frames']:>7} | Family Saved: {result['family_saved']:>3} | "
+                      f"{'Dead' if result['died'] else 'Stopped'} ({len(results)}/{len(tasks)})")
+                if resultsFile:
+                    resultsFile.write(json.dumps(result) + "\n")
+                    resultsFile.flush()
+    finally:
+        if resultsFile:
+            resultsFile.close()
+
+    print()
+    printTable(summarize(results))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Play FSM games in parallel and summarize them by wave')
+    parser.add_argument('--level', type=int, default=1, help='Start Level')
+    parser.add_argument('--lives', type=int, default=3, help='Start Lives')
+    parser.add_argument('--godmode', action='store_true', help='Enable GOD Mode (Can\'t die.)')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (0 is one per core)')
+    parser.add_argument('--games', type=int, default=10, help='Games per worker')
+    parser.add_argument('--engine', choices=list(robotron_fsm.CHOOSE_OUTPUTS_ENGINES),
+                        default=robotron_fsm.ENGINE_PYTHON, help='chooseOutputs implementation')
+    parser.add_argument('--max-frames', type=int, default=100000, help='Stop a game after this many frames')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game, the rest count up from it')
+    parser.add_argument('--results', type=str, default=None, help='Also write each game as a JSON line here')
+
+    args = parser.parse_args()
+    main(args.level, args.lives, args.godmode, args.workers, args.games, args.engine, args.max_frames, args.seed,
+         args.results)
@@ -0,0 +1,104 @@
+"""
+Decision trace for robotron_fsm
+
+Replaces the DEBUG_LEVEL print statements. Tracing is switched on by swapping in a traced decision function,
+so when it is off nothing in the FSM checks for it. When it is on, every decision is packed into a fixed-width
+record in a preallocated ring buffer, which keeps the most recent capacity decisions and can be dumped to a
+.npy file afterwards:
+
+    trace = np.load("trace.npy")
+    trace[trace["adjacentCategory"] == 0]["sticks"]
+"""
+
+import struct
+import numpy as np
+
+NO_TARGET = [-1, 0, 0]
+
+
+class DecisionTrace:
+    """
+    capacity - number of decisions kept, older ones are overwritten
+    categoryCount - number of nearest-target slots in each record
+    """
+
+    def __init__(self, capacity, categoryCount):
+        self.capacity = capacity
+        self.categoryCount = categoryCount
+        """ little endian with no padding, so the struct format and the numpy dtype lay out the same bytes """
+        self.format = struct.Struct('<IHhhbhhhh' + 'hhh' * categoryCount + 'bb')
+        self.dtype = np.dtype([
+            ('frame', '<u4'),
+            ('board', '<u2'),
+            ('player', '<i2', 2),
+            ('adjacentCategory', 'i1'),
+            ('adjacent', '<i2', 3),
+            ('closeMoveCount', '<i2'),
+            ('nearest', '<i2', (categoryCount, 3)),
+            ('sticks', 'i1', 2),
+        ])
+        assert self.dtype.itemsize == self.format.size
+        self.buffer = bytearray(self.format.size * capacity)
+        self.records = np.frombuffer(self.buffer, dtype=self.dtype)
+        self.frame = 0
+        self.count = 0
+
+    """
+    One decision. adjacent and each entry of nearest are [DISTANCE, X_DISTANCE, Y_DISTANCE], or INVALID (-1)
+    for none, which is stored as distance -1.
+    """
+
+    def record(self, playerLocation, adjacentCategory, adjacent, closeMoveCount, nearest, sticks, board=0):
+        values = [self.frame, board, playerLocation[0], playerLocation[1], adjacentCategory]
+        values += adjacent if adjacent != -1 else NO_TARGET
+        values.append(closeMoveCount)
+        for target in nearest:
+            values += target if target != -1 else NO_TARGET
+        values += sticks
+        self.format.pack_into(self.buffer, (self.count % self.capacity) * self.format.size, *values)
+        self.count += 1
+        self.frame += 1
+
+    """
+    A batch of boards decided in the same frame, as arrays with one row per board.
+    adjacent and nearest hold [DISTANCE, X_DISTANCE, Y_DISTANCE] rows, with distance -1 for none.
+    """
+
+    def recordBatch(self, playerX, playerY, adjacentCategory, adjacent, closeMoveCount, nearest, sticks):
+        boards = len(playerX)
+        if boards > self.capacity:
+            """ only the last capacity boards would survive anyway """
+            skip = boards - self.capacity
+            self.count += skip
+            playerX, playerY, adjacentCategory, adjacent, closeMoveCount, nearest, sticks, firstBoard = (
+                playerX[skip:], playerY[skip:], adjacentCategory[skip:], adjacent[skip:], closeMoveCount[skip:],
+                nearest[skip:], sticks[skip:], skip)
+            boards = self.capacity
+        else:
+            firstBoard = 0
+        rows = (self.count + np.arange(boards)) % self.capacity
+        records = self.records
+        records['frame'][rows] = self.frame
+        records['board'][rows] = firstBoard + np.arange(boards)
+        records['player'][rows, 0] = playerX
+        records['player'][rows, 1] = playerY
+        records['adjacentCategory'][rows] = adjacentCategory
+        records['adjacent'][rows] = adjacent
+        records['closeMoveCount'][rows] = closeMoveCount
+        records['nearest'][rows] = nearest
+        records['sticks'][rows] = sticks
+        self.count += boards
+        self.frame += 1
+
+    """
+    Recorded decisions, oldest first
+    """
+
+    def ordered(self):
+        if self.count <= self.capacity:
+            return self.records[:self.count]
+        start = self.count % self.capacity
+        return np.concatenate([self.records[start:], self.records[:start]])
+
+    def dump(self, path):
+        np.save(path, self.ordered())
@@ -0,0 +1,160 @@
+"""
+HOW TO RUN THIS
+python inference_bench.py --model qrdqn --checkpoint models/<run id>/checkpoint_500000
+python inference_bench.py --model qrdqn --checkpoint model.zip --workers 1 4 8 16 --max-wait 0.005 --modes server
+
+"""
+
+"""
+Policy Inference Benchmarks
+
+Plays a saved model in worker processes, each with its own env, and measures how many frames/sec they get through
+together for each number of workers, with actions chosen either:
+- local: every worker loads its own copy of the model and runs one forward pass per frame
+- server: every worker asks one InferenceServer, which batches requests from all of them
+
+and reports frames/sec, the time workers spent waiting for actions, the server's mean batch size and the peak RSS
+of this process and its workers. Results are written as JSON.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import time
+
+import numpy as np
+import torch as th
+
+from env_bench import tree_rss
+from robotron_fsm import useHeadlessDisplay
+from utils import InferenceServer, load_model, make_policy_env
+from utils.inference import MODEL_CLASSES, saved_spaces
+
+OUTPUT_PATH = "inference_bench.json"
+LOCAL = "local"
+SERVER = "server"
+MODES = (LOCAL, SERVER)
+
+
+def play(worker: int, model_path: str, model_name: str, client, env_config: dict, frame_skip: int, steps: int,
+         seed: int, start, results) -> None:
+    """
+    Worker process: play steps frames, with the model's actions from client, or from its own copy without one
+    """
+    th.set_num_threads(1)
+    if client is None:
+        policy = load_model(model_path, model_name).policy
+        predict = lambda obs: policy.predict(obs, deterministic=True)[0]
+    else:
+        predict = client.predict
+    env = make_policy_env(env_config, saved_spaces(model_path)[0], frame_skip=frame_skip, seed=seed + worker)
+    obs = env.reset()
+
+    start.wait()
+    began = time.perf_counter()
+    waiting = 0.0
+    for _ in range(steps):
+        request = time.perf_counter()
+        action = predict(obs[0])
+        waiting += time.perf_counter() - request
+        obs, _, _, _ = env.step(np.array([action]))
+    results.put({"worker": worker, "elapsed": time.perf_counter() - began, "waiting": waiting})
+
+    env.close()
+    if client is not None:
+        client.close()
+
+
+def bench(mode: str, model_path: str, model_name: str, workers: int, env_config: dict, frame_skip: int, steps: int,
+          seed: int, max_batch: int, max_wait: float, server_threads: int) -> dict:
+    server = None
+    if mode == SERVER:
+        server = InferenceServer(model_path, model_name, workers, max_batch=max_batch, max_wait=max_wait,
+                                 threads=server_threads).start()
+    start = multiprocessing.Barrier(workers + 1)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=play, daemon=True,
+                                         args=(worker, model_path, model_name, server and server.client(worker),
+                                               env_config, frame_skip, steps, seed, start, results))
+                 for worker in range(workers)]
+    try:
+        for process in processes:
+            process.start()
+        start.wait()
+        peak_rss = tree_rss()
+        worker_results = []
+        while len(worker_results) < workers:
+            worker_results.append(results.get())
+            peak_rss = max(peak_rss, tree_rss())
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        if server:
+            server.stop()
+
+    elapsed = max(result["elapsed"] for result in worker_results)
+    result = {
+        "mode": mode,
+        "workers": workers,
+        "frames_per_sec": workers * steps / elapsed,
+        "wait_ms": float(np.mean([result["waiting"] for result in worker_results]) / steps * 1000),
+        "mean_batch": server.stats()["mean_batch"] if server else 1.0,
+        "peak_rss_mb": peak_rss / 2 ** 20,
+    }
+    return result
+
+
+def main(model_path: str, model_name: str, config_path: str, modes: list, workers: list, steps: int, level: int,
+         frame_skip: int, seed: int, max_batch: int, max_wait: float, server_threads: int, output_path: str) -> None:
+    # inherited by the workers
+    useHeadlessDisplay()
+    env_config = {"config_path": config_path, "level": level, "lives": 0, "fps": 0, "always_move": True}
+
+    print(f"{'Benchmark':<20} {'frames/s':>9} {'wait ms':>8} {'batch':>6} {'RSS MB':>8}")
+    results = []
+    for count in workers:
+        for mode in modes:
+            result = bench(mode, model_path, model_name, count, env_config, frame_skip, steps, seed, max_batch,
+                           max_wait, server_threads)
+            results.append(result)
+            print(f"{mode + '/' + str(count) + 'workers':<20} {result['frames_per_sec']:>9.1f} "
+                  f"{result['wait_ms']:>8.2f} {result['mean_batch']:>6.1f} {result['peak_rss_mb']:>8.0f}", flush=True)
+
+    with open(output_path, "w") as f:
+        json.dump({
+            "system": {"platform": platform.platform(), "python": platform.python_version(),
+                       "cpus": os.cpu_count()},
+            "settings": {"model": model_path, "config": config_path, "steps": steps, "level": level,
+                         "frame_skip": frame_skip, "seed": seed, "max_batch": max_batch, "max_wait": max_wait,
+                         "server_threads": server_threads},
+            "results": results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Policy inference throughput benchmarks')
+    parser.add_argument('--model', choices=list(MODEL_CLASSES), required=True,
+                        help='Algorithm the model was trained with')
+    parser.add_argument('--checkpoint', type=str, required=True, help='Model zip or checkpoint directory')
+    parser.add_argument('--config', type=str, default=None, help='Game config, the same one train.py used')
+    parser.add_argument('--modes', choices=MODES, nargs='+', default=list(MODES), help='Where actions come from')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker process counts')
+    parser.add_argument('--steps', type=int, default=1000, help='Frames each worker plays')
+    parser.add_argument('--level', type=int, default=1, help='Starting wave')
+    parser.add_argument('--frame-skip', type=int, default=1, help='Same as train.py --frame-skip')
+    parser.add_argument('--seed', type=int, default=0, help='Worker i plays with seed + i')
+    parser.add_argument('--max-batch', type=int, default=None, help='Largest server batch, all workers when not set')
+    parser.add_argument('--max-wait', type=float, default=0.002,
+                        help='Seconds the server waits for more requests after the first one of a batch')
+    parser.add_argument('--server-threads', type=int, default=1, help='Torch threads in the server')
+    parser.add_argument('--output', type=str, default=OUTPUT_PATH, help='JSON results file')
+    args = parser.parse_args()
+
+    main(args.checkpoint, args.model, args.config, args.modes, args.workers, args.steps, args.level, args.frame_skip,
+         args.seed, args.max_batch, args.max_wait, args.server_threads, args.output)
@@ -0,0 +1,276 @@
+"""
+HOW TO RUN THIS
+python local_sweep.py dqn_sweep.yaml --trials 27 --cores-per-trial 2
+python local_sweep.py dqn_sweep.yaml --name lr-search --min-timesteps 100000 --max-timesteps 2000000 --eta 4
+python local_sweep.py --show lr-search                # leaderboard from the results store
+
+"""
+
+"""
+Local QRDQN Sweeps
+
+Runs a hyperparameter sweep on one machine, without the hosted sweep service or any network access. The search
+space is a sweep file in the wandb sweep format: parameters given as value, values, or a distribution (uniform,
+log_uniform_values, int_uniform) with min and max.
+
+Trials are dqn_sweep.py --trial-dir processes, each pinned to its own cores-per-trial CPU cores with torch and BLAS
+limited to threads-per-trial threads. Their env workers inherit the cores.
+
+Weak trials are stopped early with asynchronous successive halving: trials are trained in segments up to rung
+budgets min-timesteps, min-timesteps * eta, ... up to max-timesteps, and a trial that finished a rung is promoted to
+the next one when its score is in the top 1/eta of the trials that finished that rung so far. Promoted trials
+continue from the checkpoint of their last segment. Whenever a slot frees up the best promotion is run, or a new
+trial is started if there is none. A trial's score is its mean episode score over the last episodes of a segment.
+
+Every trial and segment result is written to an SQLite results store, sweeps.db by default.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+import yaml
+
+STORE_PATH = "sweeps.db"
+SWEEPS_DIR = "sweeps"
+TRIAL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dqn_sweep.py")
+POLL_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    sweep TEXT, trial INTEGER, params TEXT, started REAL,
+    PRIMARY KEY (sweep, trial)
+);
+CREATE TABLE IF NOT EXISTS results (
+    sweep TEXT, trial INTEGER, rung INTEGER, timesteps INTEGER, score REAL, episodes INTEGER, seconds REAL,
+    status TEXT, finished REAL
+);
+"""
+
+
+def sample_params(parameters: dict, rng: random.Random) -> dict:
+    """
+    One set of parameters from a wandb style sweep parameters section
+    """
+    params = {}
+    for name, spec in parameters.items():
+        if "value" in spec:
+            params[name] = spec["value"]
+        elif "values" in spec:
+            params[name] = rng.choice(spec["values"])
+        else:
+            distribution = spec.get("distribution", "uniform")
+            if distribution == "uniform":
+                params[name] = rng.uniform(spec["min"], spec["max"])
+            elif distribution == "log_uniform_values":
+                params[name] = math.exp(rng.uniform(math.log(spec["min"]), math.log(spec["max"])))
+            elif distribution == "int_uniform":
+                params[name] = rng.randint(spec["min"], spec["max"])
+            else:
+                raise ValueError(f"Unsupported distribution {distribution} for {name}")
+    return params
+
+
+def rung_budgets(min_timesteps: int, max_timesteps: int, eta: int) -> list:
+    budgets = []
+    budget = min_timesteps
+    while budget < max_timesteps:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_timesteps)
+    return budgets
+
+
+def open_store(store_path: str) -> sqlite3.Connection:
+    store = sqlite3.connect(store_path)
+    store.executescript(SCHEMA)
+    return store
+
+
+class Scheduler:
+    """
+    Asynchronous successive halving over trials run as local processes
+    """
+
+    def __init__(self, name: str, parameters: dict, store: sqlite3.Connection, sweep_dir: str, trials: int,
+                 budgets: list, eta: int, core_sets: list, threads: int, num_envs: int, device: str, seed: int):
+        self.name = name
+        self.parameters = parameters
+        self.store = store
+        self.sweep_dir = sweep_dir
+        self.trials = trials
+        self.budgets = budgets
+        self.eta = eta
+        self.free_cores = list(core_sets)
+        self.threads = threads
+        self.num_envs = num_envs
+        self.device = device
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.params = {}
+        # rung: {trial: score} for every trial that finished that rung
+        self.scores = [{} for _ in budgets]
+        self.promoted = set()
+        # process: (trial, rung, cores, start time)
+        self.running = {}
+
+    def next_job(self):
+        """
+        (trial, rung) to run next: the best promotion from the highest rung, else a new trial, else None
+        """
+        for rung in reversed(range(len(self.budgets) - 1)):
+            finished = sorted(self.scores[rung].items(), key=lambda item: item[1], reverse=True)
+            for trial, score in finished[:len(finished) // self.eta]:
+                if (trial, rung) not in self.promoted:
+                    self.promoted.add((trial, rung))
+                    return trial, rung + 1
+        if len(self.params) < self.trials:
+            trial = len(self.params)
+            self.params[trial] = sample_params(self.parameters, self.rng)
+            self.store.execute("INSERT INTO trials VALUES (?, ?, ?, ?)",
+                               (self.name, trial, json.dumps(self.params[trial]), time.time()))
+            self.store.commit()
+            return trial, 0
+        return None
+
+    def trial_dir(self, trial: int) -> str:
+        return os.path.join(self.sweep_dir, f"trial_{trial:03d}")
+
+    def start(self, trial: int, rung: int) -> None:
+        cores = self.free_cores.pop()
+        trial_dir = self.trial_dir(trial)
+        os.makedirs(trial_dir, exist_ok=True)
+        result_path = os.path.join(trial_dir, "result.json")
+        if os.path.exists(result_path):
+            os.remove(result_path)
+
+        command = [sys.executable, TRIAL_SCRIPT, "--trial-dir", trial_dir, "--params", json.dumps(self.params[trial]),
+                   "--timesteps", str(self.budgets[rung]), "--max-timesteps", str(self.budgets[-1]),
+                   "--threads", str(self.threads), "--num-envs", str(self.num_envs), "--device", self.device,
+                   "--seed", str(self.seed + trial)]
+        threads = str(self.threads)
+        env = dict(os.environ, OMP_NUM_THREADS=threads, MKL_NUM_THREADS=threads, OPENBLAS_NUM_THREADS=threads,
+                   WANDB_MODE="disabled", SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+        with open(os.path.join(trial_dir, f"rung_{rung}.log"), "w") as log:
+            process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                       preexec_fn=lambda: os.sched_setaffinity(0, cores))
+        self.running[process] = (trial, rung, cores, time.time())
+        print(f"Trial {trial} rung {rung}: training to {self.budgets[rung]} timesteps on cores {sorted(cores)}",
+              flush=True)
+
+    def finish(self, process: subprocess.Popen) -> None:
+        trial, rung, cores, start = self.running.pop(process)
+        self.free_cores.append(cores)
+        result_path = os.path.join(self.trial_dir(trial), "result.json")
+        if process.returncode == 0 and os.path.exists(result_path):
+            with open(result_path) as f:
+                result = json.load(f)
+            status = "ok"
+            # a segment without a finished episode can't be ranked, it ranks last
+            self.scores[rung][trial] = result["score"] if result["score"] is not None else -math.inf
+        else:
+            result = {"timesteps": None, "score": None, "episodes": None, "seconds": time.time() - start}
+            status = f"failed ({process.returncode})"
+        self.store.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (self.name, trial, rung, result["timesteps"], result["score"], result["episodes"],
+                            result["seconds"], status, time.time()))
+        self.store.commit()
+        print(f"Trial {trial} rung {rung}: {status}, score {result['score']}", flush=True)
+
+    def run(self) -> None:
+        while True:
+            while self.free_cores:
+                job = self.next_job()
+                if job is None:
+                    break
+                self.start(*job)
+            if not self.running:
+                return
+            time.sleep(POLL_SECONDS)
+            for process in [process for process in self.running if process.poll() is not None]:
+                self.finish(process)
+
+    def stop(self) -> None:
+        for process in self.running:
+            process.terminate()
+        for process in self.running:
+            process.wait()
+
+
+def show(store: sqlite3.Connection, name: str, top: int = 20) -> None:
+    """
+    Print the best trials of a sweep, by the score of the highest rung each reached
+    """
+    rows = store.execute("""
+        SELECT r.trial, r.rung, r.timesteps, r.score, t.params FROM results r JOIN trials t USING (sweep, trial)
+        WHERE r.sweep = ? AND r.status = 'ok' ORDER BY r.trial, r.rung""", (name,)).fetchall()
+    best = {}
+    for trial, rung, timesteps, score, params in rows:
+        best[trial] = (rung, timesteps, score, params)
+    ranked = sorted(best.items(), key=lambda item: (item[1][0], item[1][2] if item[1][2] is not None else -math.inf),
+                    reverse=True)
+    print(f"{'trial':>5} {'rung':>4} {'timesteps':>10} {'score':>10}  params")
+    for trial, (rung, timesteps, score, params) in ranked[:top]:
+        score = f"{score:>10.1f}" if score is not None else f"{'-':>10}"
+        print(f"{trial:>5} {rung:>4} {timesteps:>10} {score}  {params}")
+
+
+def main(sweep_path: str, name: str, store_path: str, trials: int, min_timesteps: int, max_timesteps: int,
+         eta: int, cores_per_trial: int, threads_per_trial: int, parallel: int, num_envs: int, device: str,
+         seed: int) -> None:
+    with open(sweep_path) as f:
+        sweep = yaml.safe_load(f)
+    name = name or os.path.splitext(os.path.basename(sweep_path))[0]
+    store = open_store(store_path)
+    if store.execute("SELECT 1 FROM trials WHERE sweep = ?", (name,)).fetchone():
+        raise ValueError(f"{store_path} already has a sweep named {name}, pick another --name")
+
+    cores = sorted(os.sched_getaffinity(0))
+    core_sets = [set(cores[i:i + cores_per_trial]) for i in range(0, len(cores) - cores_per_trial + 1, cores_per_trial)]
+    if not core_sets:
+        raise ValueError(f"--cores-per-trial {cores_per_trial} is more than the {len(cores)} cores available")
+    core_sets = core_sets[:parallel] if parallel else core_sets
+
+    budgets = rung_budgets(min_timesteps, max_timesteps, eta)
+    print(f"Sweep {name}: {trials} trials, {len(core_sets)} at a time, rungs {budgets}")
+    scheduler = Scheduler(name, sweep["parameters"], store, os.path.join(SWEEPS_DIR, name), trials, budgets, eta,
+                          core_sets, threads_per_trial or cores_per_trial, num_envs, device, seed)
+    try:
+        scheduler.run()
+    finally:
+        scheduler.stop()
+    show(store, name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local QRDQN sweep with successive halving')
+    parser.add_argument('sweep', type=str, nargs='?', help='Sweep file with the parameters to search')
+    parser.add_argument('--name', type=str, default=None, help='Sweep name in the store, the file name by default')
+    parser.add_argument('--store', type=str, default=STORE_PATH, help='SQLite results store')
+    parser.add_argument('--show', type=str, default=None, metavar='NAME', help='Print the results of a sweep and exit')
+    parser.add_argument('--trials', type=int, default=27, help='Trials to start')
+    parser.add_argument('--min-timesteps', type=int, default=250_000, help='Budget of the first rung')
+    parser.add_argument('--max-timesteps', type=int, default=5_000_000, help='Budget of the last rung')
+    parser.add_argument('--eta', type=int, default=3, help='Keep the top 1/eta at each rung')
+    parser.add_argument('--cores-per-trial', type=int, default=2, help='CPU cores pinned to each trial')
+    parser.add_argument('--threads-per-trial', type=int, default=None, help='Torch threads, cores-per-trial by default')
+    parser.add_argument('--parallel', type=int, default=None, help='Trials at a time, as many as the cores allow by default')
+    parser.add_argument('--num-envs', type=int, default=1, help='Envs per trial')
+    parser.add_argument('--device', type=str, default='cpu', help='Torch device for every trial')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for sampling parameters, trial i seeds its envs with seed + i')
+    args = parser.parse_args()
+
+    if args.show:
+        show(open_store(args.store), args.show)
+    elif args.sweep:
+        main(args.sweep, args.name, args.store, args.trials, args.min_timesteps, args.max_timesteps, args.eta,
+             args.cores_per_trial, args.threads_per_trial, args.parallel, args.num_envs, args.device, args.seed)
+    else:
+        parser.error("a sweep file or --show is required")
@@ -2,24 +2,39 @@
 Train using Stable Baselines3
 """
 import argparse
+import os
 
-from robotron2084gym.robotron import RobotronEnv
-from gymnasium.wrappers import GrayScaleObservation, ResizeObservation
-from stable_baselines3.common.vec_env import DummyVecEnv, VecFrameStack
-from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import VecFrameStack
 from stable_baselines3 import PPO
 from sb3_contrib import QRDQN
-from utils import WandBVideoRecorderWrapper
+from utils import (OBSERVATION_OBJECTS, OBSERVATION_PIXELS, OBSERVATIONS, BackgroundCheckpointCallback,
+                   FrameStackReplayBuffer, StageProfiler, ThroughputCallback, VecStageTimer,
+                   WandBVideoRecorderWrapper, behaviour_clone, load_checkpoint, load_manifest, make_vec_env,
+                   prefill_replay_buffer)
 from wandb.integration.sb3 import WandbCallback
 import wandb
 
 
-def main(model_name: str, config_path: str = None, resume_path: str = None, project: str = None, group: str = None, device: str = 'cuda:0'):
+def main(model_name: str, config_path: str = None, resume_path: str = None, project: str = None, group: str = None, device: str = 'cuda:0',
+         num_envs: int = 1, seed: int = None, levels: list = None, replay_memmap: str = None, video_scale: float = 1.0,
+         frame_skip: int = 1, throughput_log: str = None, demos: str = None, bc_epochs: int = 0,
+         observation: str = OBSERVATION_PIXELS):
     config = {
         'model': model_name,
         "env_name": "robotron",
         'resume_path': resume_path,
         "total_timesteps": 55_500_000,
+        "checkpoint_freq": 500_000,
+        "throughput_interval": 1000,
+        "num_envs": num_envs,
+        "seed": seed,
+        "levels": levels,
+        "frame_stack": 4,
+        "frame_skip": frame_skip,
+        "observation": observation,
+        "video_scale": video_scale,
+        "demos": demos,
+        "bc_epochs": bc_epochs,
 
         'env': {
             'config_path': config_path,
@@ -46,9 +61,15 @@ def main(model_name: str, config_path: str = None, resume_path: str = None, proj
             "max_grad_norm": 10,
             "exploration_fraction": 0.1,
             "exploration_final_eps": 0.01,
+            "replay_buffer_class": FrameStackReplayBuffer,
+            "replay_buffer_kwargs": {"frame_stack": config['frame_stack'], "memmap_dir": replay_memmap},
         }
     else:
         raise ValueError(f"Unknown model name: {model_name}")
+    if observation == OBSERVATION_OBJECTS:
+        # a stack of object vectors rather than images, the CNN has nothing to convolve
+        config['model_kwargs']["policy"] = "MlpPolicy"
+        config['model_kwargs']["policy_kwargs"] = {"net_arch": [256, 256]}
 
     run = wandb.init(
         project=project or "robotron",
@@ -61,33 +82,58 @@ def main(model_name: str, config_path: str = None, resume_path: str = None, proj
 
     run.log_code(name="game_config", include_fn=lambda x: x.endswith(".yaml"))
 
-    env = RobotronEnv(**config['env'])
-    env = GrayScaleObservation(env, keep_dim=True)
-    env = ResizeObservation(env, (123, 166))
-    env = Monitor(env)
-    env = DummyVecEnv([lambda: env])
-    env = WandBVideoRecorderWrapper(env, record_video_trigger=lambda x: x % 2000 == 0, video_length=200)
-    env = VecFrameStack(env, 4, channels_order='first')
+    # each stage of the env stack is timed on its own, see ThroughputCallback
+    profiler = StageProfiler()
+    env = make_vec_env(config['env'], num_envs=num_envs, seed=seed, levels=levels, frame_skip=frame_skip,
+                       stage_timing=True, observation=observation)
+    env = VecStageTimer(env, profiler, "vec_env")
+    env = WandBVideoRecorderWrapper(env, record_video_trigger=lambda x: x % 2000 == 0, video_length=200,
+                                    video_scale=video_scale)
+    env = VecStageTimer(env, profiler, "video")
+    env = VecFrameStack(env, config['frame_stack'], channels_order='first')
+    env = VecStageTimer(env, profiler, "frame_stack")
 
     env.reset()
 
-    if resume_path:
+    # a checkpoint directory resumes training where it stopped, a model zip only restores the weights
+    resumed = bool(resume_path) and os.path.isdir(resume_path)
+    if resumed:
+        model = load_checkpoint(resume_path, model_class, env=env, verbose=1, device=device,
+                                tensorboard_log=f"runs/{run.id}", **config['model_kwargs'])
+    elif resume_path:
         model = model_class.load(path=resume_path, env=env, verbose=1, device=device,
                                  tensorboard_log=f"runs/{run.id}", **config['model_kwargs'])
     else:
         model = model_class(env=env, verbose=1,
                             tensorboard_log=f"runs/{run.id}", device=device, **config['model_kwargs'])
 
+    # FSM demonstrations from fsm_demos.py, a resumed run already has them in its replay buffer
+    if demos and not resumed:
+        load_manifest(demos, frame_skip, observation)
+        if bc_epochs:
+            loss = behaviour_clone(model, demos, config['frame_stack'], epochs=bc_epochs, seed=seed)
+            run.log({"demos/bc_loss": loss})
+        if getattr(model, "replay_buffer", None) is not None:
+            transitions = prefill_replay_buffer(model.replay_buffer, demos)
+            run.log({"demos/transitions": transitions})
+            # the buffer already holds experience, learn from the first step instead of acting randomly first
+            model.learning_starts = 0
+
     model.learn(
-        total_timesteps=config["total_timesteps"],
-        callback=WandbCallback(
-            gradient_save_freq=100,
-            model_save_freq=500_000,
-            model_save_path=f"models/{run.id}",
-            verbose=2,
-        ),
+        total_timesteps=config["total_timesteps"] - (model.num_timesteps if resumed else 0),
+        reset_num_timesteps=not resumed,
+        callback=[
+            profiler.wrap(WandbCallback(
+                gradient_save_freq=100,
+                verbose=2,
+            ), "on_step", "logging"),
+            ThroughputCallback(profiler, interval=config["throughput_interval"], log_path=throughput_log),
+            BackgroundCheckpointCallback(config["checkpoint_freq"], f"models/{run.id}", verbose=1),
+        ],
     )
 
+    # also logs the videos still being encoded
+    env.close()
     run.finish()
 
 
@@ -95,9 +141,28 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, required=True)
     parser.add_argument("--config", type=str, default=None)
-    parser.add_argument("--resume", type=str, default=None)
+    parser.add_argument("--resume", type=str, default=None,
+                        help="checkpoint directory to continue training from, or a model zip to start from its weights")
     parser.add_argument("--project", type=str, default=None)
     parser.add_argument("--group", type=str, default=None)
     parser.add_argument("--device", type=str, default='cuda:0')
+    parser.add_argument("--num-envs", type=int, default=1, help="envs stepped in parallel, one process each when > 1")
+    parser.add_argument("--seed", type=int, default=None, help="env i is seeded with seed + i")
+    parser.add_argument("--levels", type=int, nargs='+', default=None, help="starting level of each env, cycled")
+    parser.add_argument("--replay-memmap", type=str, default=None,
+                        help="directory for a disk-backed qrdqn replay buffer, kept in RAM when not set")
+    parser.add_argument("--video-scale", type=float, default=1.0, help="downscale recorded videos, e.g. 0.5")
+    parser.add_argument("--frame-skip", type=int, default=1,
+                        help="repeat each action for N game frames, max pooling the last two")
+    parser.add_argument("--throughput-log", type=str, default=None,
+                        help="also append samples/sec and per-stage timings to this JSON lines file")
+    parser.add_argument("--demos", type=str, default=None,
+                        help="fsm_demos.py output to fill the replay buffer with before training")
+    parser.add_argument("--bc-epochs", type=int, default=0,
+                        help="also clone the demonstrated actions into the policy for this many epochs first")
+    parser.add_argument("--observation", choices=OBSERVATIONS, default=OBSERVATION_PIXELS,
+                        help="pixels of the play area, or the game's object list as a vector for an MLP policy")
     args = parser.parse_args()
-    main(args.model, args.config, args.resume, args.project, args.group, args.device)
+    main(args.model, args.config, args.resume, args.project, args.group, args.device, args.num_envs, args.seed,
+         args.levels, args.replay_memmap, args.video_scale, args.frame_skip,
+         args.throughput_log, args.demos, args.bc_epochs, args.observation)
@@ -1 +1,12 @@
 from .wandb_video_recorder_wrapper import WandBVideoRecorderWrapper
+from .frame_skip import FrameSkip
+from .object_observation import (OBSERVATION_OBJECTS, OBSERVATION_PIXELS, OBSERVATIONS, ObjectStateEncoder,
+                                 ObjectStateObservation)
+from .game_config import GameConfig, compile_config
+from .observation import PlayAreaObservation, PlayAreaPreprocessor, load_play_area
+from .profiling import EnvStageTimer, StageProfiler, ThroughputCallback, VecStageTimer
+from .vec_env import make_env, make_policy_env, make_vec_env
+from .replay_buffer import FrameStackReplayBuffer
+from .checkpoint import BackgroundCheckpointCallback, load_checkpoint, save_checkpoint
+from .demonstrations import behaviour_clone, load_manifest, prefill_replay_buffer
+from .inference import InferenceClient, InferenceServer, load_model
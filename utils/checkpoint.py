@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+import shutil
+import warnings
+import zipfile
+from typing import Any, Dict, List, Optional, Type
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import save_to_pkl
+
+from .replay_buffer import FrameStackReplayBuffer
+
+CHECKPOINT_PREFIX = "checkpoint_"
+MODEL_FILE = "model.zip"
+REPLAY_BUFFER_FILE = "replay_buffer.npz"
+# any other replay buffer class is pickled whole
+REPLAY_BUFFER_PICKLE = "replay_buffer.pkl"
+# slots per read when loading frames straight into the buffer
+FRAME_CHUNK = 1024
+
+
+def to_cpu(value: Any) -> Any:
+    """
+    Copy every tensor in a nest of dicts and lists to the CPU
+    """
+    if isinstance(value, th.Tensor):
+        return value.detach().cpu()
+    if isinstance(value, dict):
+        return {key: to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(to_cpu(item) for item in value)
+    return value
+
+
+def fsync_path(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_replay_buffer(buffer: FrameStackReplayBuffer, path: str, steps_since_snapshot=None) -> None:
+    """
+    Write a FrameStackReplayBuffer as a compressed npz, one array at a time so the frames are never copied whole.
+
+    Memory-mapped frames are shared with the training process and keep changing while they are read. In that case
+    steps_since_snapshot counts the steps training has taken since, and is stored after the frames as stale_slots.
+    """
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for name, array in buffer.state_dict().items():
+            with archive.open(name + ".npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+        # add() runs just after the callback counts a step, so one more slot may already be written
+        stale_slots = steps_since_snapshot.value + 1 if steps_since_snapshot is not None and buffer.memmap_dir else 0
+        with archive.open("stale_slots.npy", "w") as f:
+            np.lib.format.write_array(f, np.array(stale_slots))
+
+
+def load_replay_buffer(buffer: FrameStackReplayBuffer, path: str) -> None:
+    """
+    Restore a FrameStackReplayBuffer from save_replay_buffer. Frames are read a chunk at a time straight into
+    buffer.frames, so a memory-mapped buffer never needs them all in RAM.
+    """
+    with zipfile.ZipFile(path) as archive, archive.open("frames.npy") as f:
+        version = np.lib.format.read_magic(f)
+        shape, fortran_order, dtype = (np.lib.format.read_array_header_1_0(f) if version == (1, 0)
+                                       else np.lib.format.read_array_header_2_0(f))
+        if shape != buffer.frames.shape or dtype != buffer.frames.dtype or fortran_order:
+            raise ValueError(f"Replay buffer checkpoint frames are {shape} {dtype}, "
+                             f"expected {buffer.frames.shape} {buffer.frames.dtype}")
+        for start in range(0, len(buffer.frames), FRAME_CHUNK):
+            chunk = buffer.frames[start:start + FRAME_CHUNK]
+            if f.readinto(memoryview(chunk).cast("B")) != chunk.nbytes:
+                raise ValueError(f"Replay buffer checkpoint {path} is truncated")
+
+    with np.load(path) as state:
+        buffer.load_state_dict({name: state[name] for name in state.files if name not in ("frames", "stale_slots")},
+                               stale_slots=int(state["stale_slots"]))
+
+
+def list_checkpoints(directory: str) -> List[str]:
+    """
+    Names of the complete checkpoints save_checkpoint wrote in directory, oldest first
+    """
+    return sorted((name for name in os.listdir(directory)
+                   if name.startswith(CHECKPOINT_PREFIX) and name[len(CHECKPOINT_PREFIX):].isdigit()),
+                  key=lambda name: int(name[len(CHECKPOINT_PREFIX):]))
+
+
+def save_checkpoint(model: BaseAlgorithm, path: str, params: Optional[Dict[str, Dict]] = None,
+                    steps_since_snapshot=None) -> None:
+    """
+    Write model.zip (weights, optimizer state, timestep counters and schedules, loadable with model_class.load)
+    and the replay buffer into directory path. Everything is written to a temporary directory next to it and renamed
+    into place, so path either doesn't exist or is a complete checkpoint.
+
+    params are model.get_parameters() already copied to the CPU, for a forked writer that can't use CUDA.
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path)
+    if params is not None:
+        # only ever set on the writer process's copy of the model
+        model.get_parameters = lambda: params
+    # instance attributes shadowing methods, like that one or profiling wrappers, are not part of the model
+    exclude = [name for name in vars(model) if callable(getattr(type(model), name, None))]
+    model.save(os.path.join(tmp_path, MODEL_FILE), exclude=exclude)
+    fsync_path(os.path.join(tmp_path, MODEL_FILE))
+
+    buffer = getattr(model, "replay_buffer", None)
+    if isinstance(buffer, FrameStackReplayBuffer):
+        save_replay_buffer(buffer, os.path.join(tmp_path, REPLAY_BUFFER_FILE), steps_since_snapshot)
+        fsync_path(os.path.join(tmp_path, REPLAY_BUFFER_FILE))
+    elif buffer is not None:
+        save_to_pkl(os.path.join(tmp_path, REPLAY_BUFFER_PICKLE), buffer)
+        fsync_path(os.path.join(tmp_path, REPLAY_BUFFER_PICKLE))
+
+    os.rename(tmp_path, path)
+    fsync_path(os.path.dirname(os.path.abspath(path)))
+
+
+def load_checkpoint(path: str, model_class: Type[BaseAlgorithm], env, **kwargs) -> BaseAlgorithm:
+    """
+    Load a checkpoint directory from save_checkpoint, replay buffer included. kwargs go to model_class.load.
+    Continue it with model.learn(total_timesteps - model.num_timesteps, reset_num_timesteps=False).
+    """
+    model = model_class.load(os.path.join(path, MODEL_FILE), env=env, **kwargs)
+    if os.path.exists(os.path.join(path, REPLAY_BUFFER_FILE)):
+        load_replay_buffer(model.replay_buffer, os.path.join(path, REPLAY_BUFFER_FILE))
+    elif os.path.exists(os.path.join(path, REPLAY_BUFFER_PICKLE)):
+        model.load_replay_buffer(os.path.join(path, REPLAY_BUFFER_PICKLE))
+    return model
+
+
+class BackgroundCheckpointCallback(BaseCallback):
+    """
+    Save a resumable checkpoint every save_freq timesteps from a forked process, so training keeps going while it
+    is compressed and written. The fork is a copy-on-write snapshot of the model and replay buffer, and the only
+    work done in the training process is copying the weights and optimizer state to the CPU.
+
+    A save that comes due while the last one is still writing waits for it to finish. Only the newest keep
+    checkpoints are kept, and a final one is written when training ends.
+    Platforms without fork save in the training process instead.
+    """
+
+    def __init__(self, save_freq: int, save_path: str, keep: int = 2, verbose: int = 0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.keep = keep
+        self.next_save = 0
+        self.writer = None
+        self.writer_path = None
+        self.steps_since_snapshot = None
+        self.fork = "fork" in multiprocessing.get_all_start_methods()
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+        # a resumed model starts from its own num_timesteps, the callback's is only synced on the first step
+        self.next_save = (self.model.num_timesteps // self.save_freq + 1) * self.save_freq
+
+    def _on_step(self) -> bool:
+        if self.writer is not None:
+            if self.writer.is_alive():
+                self.steps_since_snapshot.value += 1
+            else:
+                self.finish_writer()
+        if self.num_timesteps >= self.next_save and self.writer is None:
+            self.next_save = (self.num_timesteps // self.save_freq + 1) * self.save_freq
+            self.save(background=self.fork)
+        return True
+
+    def _on_training_end(self) -> None:
+        if self.writer is not None:
+            self.writer.join()
+            self.finish_writer()
+        if not os.path.exists(self.checkpoint_path()):
+            self.save(background=False)
+
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.save_path, f"{CHECKPOINT_PREFIX}{self.num_timesteps}")
+
+    def save(self, background: bool) -> None:
+        path = self.checkpoint_path()
+        if not background:
+            save_checkpoint(self.model, path)
+            self.saved(path)
+            return
+
+        context = multiprocessing.get_context("fork")
+        self.steps_since_snapshot = context.RawValue("q", 0)
+        self.writer = context.Process(target=save_checkpoint, name="checkpoint-writer", daemon=True,
+                                      args=(self.model, path, to_cpu(self.model.get_parameters()),
+                                            self.steps_since_snapshot))
+        self.writer_path = path
+        self.writer.start()
+
+    def finish_writer(self) -> None:
+        self.writer.join()
+        if self.writer.exitcode == 0:
+            self.saved(self.writer_path)
+        else:
+            warnings.warn(f"Checkpoint writer for {self.writer_path} exited with code {self.writer.exitcode}")
+            shutil.rmtree(f"{self.writer_path}.tmp{self.writer.pid}", ignore_errors=True)
+        self.writer = None
+
+    def saved(self, path: str) -> None:
+        if self.verbose:
+            print(f"Saved checkpoint {path}")
+        for name in list_checkpoints(self.save_path)[:-self.keep]:
+            shutil.rmtree(os.path.join(self.save_path, name), ignore_errors=True)
@@ -0,0 +1,204 @@
+import glob
+import json
+import os
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch as th
+import torch.nn.functional as F
+from stable_baselines3.common.base_class import BaseAlgorithm
+
+from .object_observation import OBSERVATION_PIXELS
+from .replay_buffer import FrameStackReplayBuffer
+
+MANIFEST_FILE = "manifest.json"
+SHARD_PATTERN = "shard_*.npz"
+
+
+def write_shard(path: str, episodes: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray, bool]]) -> None:
+    """
+    Write episodes to one compressed shard, via a temporary file so a shard is never left half written.
+
+    An episode is (frames, actions, rewards, terminated): T + 1 preprocessed observations, the first one from before
+    the first action and the last one from after the last, T actions and rewards, and whether the episode ended on
+    its own rather than being cut off.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(
+            f,
+            frames=np.concatenate([frames for frames, _, _, _ in episodes]),
+            actions=np.concatenate([actions for _, actions, _, _ in episodes]).astype(np.uint8),
+            rewards=np.concatenate([rewards for _, _, rewards, _ in episodes]).astype(np.float32),
+            episode_lengths=np.array([len(actions) for _, actions, _, _ in episodes], dtype=np.int64),
+            episode_terminated=np.array([terminated for _, _, _, terminated in episodes], dtype=bool),
+        )
+    os.replace(tmp_path, path)
+
+
+def load_manifest(demo_dir: str, frame_skip: Optional[int] = None, observation: Optional[str] = None) -> dict:
+    """
+    The manifest fsm_demos.py wrote, checking the demonstrations were recorded with the same frame_skip and
+    observation
+    """
+    with open(os.path.join(demo_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    manifest.setdefault("observation", OBSERVATION_PIXELS)
+    if frame_skip is not None and manifest["frame_skip"] != frame_skip:
+        raise ValueError(f"Demonstrations in {demo_dir} were recorded with frame skip {manifest['frame_skip']}, "
+                         f"not {frame_skip}")
+    if observation is not None and manifest["observation"] != observation:
+        raise ValueError(f"Demonstrations in {demo_dir} were recorded with {manifest['observation']} observations, "
+                         f"not {observation}")
+    return manifest
+
+
+def stack_observations(windows: np.ndarray, obs_shape: Sequence[int]) -> np.ndarray:
+    """
+    (batch, frame_stack, H, W, C) windows of frames to the observations the policy sees, the same as
+    VecFrameStack(channels_order='first') followed by the VecTransposeImage SB3 adds for image observations.
+    (batch, frame_stack, N) windows of object vectors are concatenated oldest first.
+    """
+    batch, frame_stack = windows.shape[:2]
+    stacked = windows.reshape((batch, frame_stack * windows.shape[2]) + windows.shape[3:])
+    if stacked.shape[1:] != tuple(obs_shape) and stacked.ndim == 4:
+        stacked = stacked.transpose(0, 3, 1, 2)
+    if stacked.shape[1:] != tuple(obs_shape):
+        raise ValueError(f"Demonstration frames {windows.shape[2:]} stacked {frame_stack} deep don't make "
+                         f"observations of shape {tuple(obs_shape)}")
+    return np.ascontiguousarray(stacked)
+
+
+class DemoShard:
+    """
+    One shard in memory, with each episode's frames preceded by frame_stack - 1 zero frames, the same padding
+    VecFrameStack gives a new episode, so the stacked observation of any step is one slice
+    """
+
+    def __init__(self, path: str, frame_stack: int):
+        with np.load(path) as data:
+            frames = data["frames"]
+            self.actions = data["actions"].astype(np.int64)
+            self.rewards = data["rewards"]
+            lengths = data["episode_lengths"]
+            terminated = data["episode_terminated"]
+
+        self.frame_stack = frame_stack
+        pad = frame_stack - 1
+        self.padded = np.zeros((len(frames) + pad * len(lengths),) + frames.shape[1:], dtype=frames.dtype)
+        self.obs_starts = np.empty(len(self.actions), dtype=np.int64)
+        self.dones = np.zeros(len(self.actions), dtype=bool)
+        self.timeouts = np.zeros(len(self.actions), dtype=bool)
+        # (first step, steps) of each episode
+        self.episodes: List[Tuple[int, int]] = []
+
+        frame = padded = step = 0
+        for length, ended in zip(lengths, terminated):
+            self.padded[padded + pad:padded + pad + length + 1] = frames[frame:frame + length + 1]
+            self.obs_starts[step:step + length] = padded + np.arange(length)
+            self.dones[step + length - 1] = True
+            self.timeouts[step + length - 1] = not ended
+            self.episodes.append((step, length))
+            frame += length + 1
+            padded += pad + length + 1
+            step += length
+
+    def observations(self, steps: np.ndarray, obs_shape: Sequence[int], next_obs: bool = False) -> np.ndarray:
+        starts = self.obs_starts[steps] + int(next_obs)
+        return stack_observations(self.padded[starts[:, None] + np.arange(self.frame_stack)], obs_shape)
+
+
+def iter_shards(demo_dir: str, frame_stack: int, shuffle: Optional[np.random.Generator] = None) -> Iterator[DemoShard]:
+    paths = sorted(glob.glob(os.path.join(demo_dir, SHARD_PATTERN)))
+    if not paths:
+        raise ValueError(f"No demonstration shards in {demo_dir}")
+    if shuffle is not None:
+        shuffle.shuffle(paths)
+    for path in paths:
+        yield DemoShard(path, frame_stack)
+
+
+def prefill_replay_buffer(buffer: FrameStackReplayBuffer, demo_dir: str, max_transitions: Optional[int] = None) -> int:
+    """
+    Add demonstration transitions to the replay buffer, whole episodes per env slot, until the demonstrations or
+    max_transitions run out. Training then starts new episodes. Returns the number of transitions added.
+    """
+    def env_steps(episodes):
+        for shard, (first, length) in episodes:
+            for step in range(first, first + length):
+                yield shard, step
+
+    # every env slot takes the next episode from the same stream
+    episodes = ((shard, episode) for shard in iter_shards(demo_dir, buffer.frame_stack) for episode in shard.episodes)
+    streams = [env_steps(episodes) for _ in range(buffer.n_envs)]
+    obs = np.zeros((buffer.n_envs,) + buffer.obs_shape, dtype=buffer.observation_space.dtype)
+    next_obs = np.zeros_like(obs)
+    actions = np.zeros(buffer.n_envs, dtype=np.int64)
+    rewards = np.zeros(buffer.n_envs, dtype=np.float32)
+    dones = np.zeros(buffer.n_envs, dtype=bool)
+
+    added = 0
+    while max_transitions is None or added < max_transitions:
+        try:
+            items = [next(stream) for stream in streams]
+        except StopIteration:
+            break
+        infos = []
+        for env, (shard, step) in enumerate(items):
+            steps = np.array([step])
+            obs[env] = shard.observations(steps, buffer.obs_shape)[0]
+            next_obs[env] = shard.observations(steps, buffer.obs_shape, next_obs=True)[0]
+            actions[env] = shard.actions[step]
+            rewards[env] = shard.rewards[step]
+            dones[env] = shard.dones[step]
+            infos.append({"TimeLimit.truncated": bool(shard.timeouts[step])})
+        buffer.add(obs, next_obs, actions, rewards, dones, infos)
+        added += buffer.n_envs
+    buffer.end_episodes()
+    return added
+
+
+def action_logits(policy, obs: th.Tensor) -> th.Tensor:
+    """
+    Per action scores to clone against: the mean of the quantiles for QRDQN, Q-values for DQN, logits for PPO
+    """
+    if hasattr(policy, "quantile_net"):
+        return policy.quantile_net(obs).mean(dim=1)
+    if hasattr(policy, "q_net"):
+        return policy.q_net(obs)
+    return policy.get_distribution(obs).distribution.logits
+
+
+def behaviour_clone(model: BaseAlgorithm, demo_dir: str, frame_stack: int = 4, epochs: int = 1, batch_size: int = 256,
+                    learning_rate: float = 1e-4, seed: Optional[int] = None) -> float:
+    """
+    Warm start the policy by training it to pick the demonstrated actions, with cross entropy over action_logits.
+    For value-based models this ranks the demonstrated action's value highest without fitting the values themselves,
+    RL fixes those afterwards. Target networks are synced at the end. Returns the mean loss of the last epoch.
+    """
+    rng = np.random.default_rng(seed)
+    policy = model.policy
+    obs_shape = model.observation_space.shape
+    optimizer = th.optim.Adam(policy.parameters(), lr=learning_rate)
+    policy.set_training_mode(True)
+    losses = []
+    for _ in range(epochs):
+        losses = []
+        for shard in iter_shards(demo_dir, frame_stack, shuffle=rng):
+            order = rng.permutation(len(shard.actions))
+            for start in range(0, len(order), batch_size):
+                steps = order[start:start + batch_size]
+                obs = th.as_tensor(shard.observations(steps, obs_shape), device=model.device)
+                actions = th.as_tensor(shard.actions[steps], device=model.device)
+                loss = F.cross_entropy(action_logits(policy, obs), actions)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                losses.append(loss.item())
+    policy.set_training_mode(False)
+
+    if hasattr(model, "quantile_net_target"):
+        model.quantile_net_target.load_state_dict(model.quantile_net.state_dict())
+    elif hasattr(model, "q_net_target"):
+        model.q_net_target.load_state_dict(model.q_net.state_dict())
+    return float(np.mean(losses)) if losses else float("nan")
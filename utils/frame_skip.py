@@ -0,0 +1,46 @@
+import gymnasium as gym
+import numpy as np
+
+
+class FrameSkip(gym.Wrapper):
+    """
+    Repeat each action for skip game frames, summing the rewards, so the policy only picks an action every skip frames.
+    The observation is the pixel-wise max of the last two raw frames, so sprites drawn on only one of them still show
+    up. Goes before the observation preprocessing, max pooling grayscale frames is not the same thing. Only those two
+    frames are copied, the ones before them are dropped as they come.
+
+    The repeat stops early when the episode ends, and the observation then includes the terminal frame: the max of it
+    and the frame before when that was one of the last two, otherwise the terminal frame alone.
+
+    max_pool=False returns the last raw frame as it is, for observations that don't use the pixels.
+    The returned observation is overwritten by the next step, copy it to keep it.
+    """
+
+    def __init__(self, env: gym.Env, skip: int = 4, max_pool: bool = True):
+        super().__init__(env)
+        self.skip = skip
+        self.max_pool = max_pool
+        if max_pool:
+            self.frames = np.zeros((2,) + env.observation_space.shape, dtype=env.observation_space.dtype)
+            self.pooled = np.zeros(env.observation_space.shape, dtype=env.observation_space.dtype)
+
+    def step(self, action):
+        total_reward = 0.0
+        kept = 0
+        for repeat in range(self.skip):
+            obs, reward, terminated, truncated, info = self.env.step(action)
+            total_reward += reward
+            done = terminated or truncated
+            if self.max_pool and (repeat >= self.skip - 2 or done):
+                self.frames[kept] = obs
+                kept += 1
+            if done:
+                break
+
+        if not self.max_pool:
+            return obs, total_reward, terminated, truncated, info
+        if kept == 1:
+            np.copyto(self.pooled, self.frames[0])
+        else:
+            np.maximum(self.frames[0], self.frames[1], out=self.pooled)
+        return self.pooled, total_reward, terminated, truncated, info
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+import yaml
+
+# enemy counts in each row of the waves table
+WAVE_COLUMNS = ("grunts", "electrodes", "hulks", "brains", "sphereoids", "quarks", "mommies", "daddies", "mikeys")
+ENEMIES = ("grunt", "electrode", "hulk", "brain", "cruisemissile", "sphereoid", "enforcer", "enforcerbullet", "quark",
+           "tank", "tankshell", "family", "prog")
+# [low, high] pairs the game picks a value between
+RANGE_KEYS = {"move_delay", "move_delays", "shoot_delays", "spawn_delays", "spawn_counts", "move_curvatures"}
+# bump when GameConfig changes, so older cache files aren't loaded
+CACHE_VERSION = 2
+CACHE_DIR = os.environ.get("ROBOTRON_CONFIG_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "robotron-rl"))
+
+# compiled configs already loaded by this process, by file hash
+COMPILED: Dict[str, "GameConfig"] = {}
+
+
+class GameConfig:
+    """
+    A game config file parsed and checked once: the waves table as an (waves, len(WAVE_COLUMNS)) int array, and
+    each enemy's parameters with numbers as int or float, [low, high] ranges as tuples and score lists as arrays.
+    Plain data, so it pickles to worker processes as it is.
+    """
+
+    # the parts of a config file GameConfig reads, all that compile_config caches
+    KEYS = ("screen_size", "play_area", "resource_path", "extra_life_score", "waves") + ENEMIES
+
+    def __init__(self, path: str, file_hash: str, raw: Dict[str, Any]):
+        self.path = path
+        self.file_hash = file_hash
+        self.screen_size = tuple(raw["screen_size"])
+        self.play_area = tuple(raw["play_area"])
+        self.resource_path = raw.get("resource_path")
+        self.extra_life_score = int(raw.get("extra_life_score", 0))
+        self.waves = np.array(raw["waves"], dtype=np.int32).reshape(-1, len(WAVE_COLUMNS))
+        self.enemies = {name: {key: typed_value(key, value) for key, value in raw[name].items()} for name in ENEMIES}
+
+    def wave(self, level: int) -> Dict[str, int]:
+        """
+        Enemy counts of a wave, numbered from 1 like RobotronEnv levels
+        """
+        return dict(zip(WAVE_COLUMNS, self.waves[level - 1].tolist()))
+
+
+def typed_value(key: str, value: Any) -> Any:
+    if isinstance(value, list):
+        if key in RANGE_KEYS:
+            return tuple(value)
+        return np.array(value)
+    return value
+
+
+def validate(raw: Any, path: str) -> None:
+    """
+    Raise ValueError naming everything wrong with a parsed config, rather than the game failing on it later
+    """
+    errors = []
+    if not isinstance(raw, dict):
+        raise ValueError(f"{path} is not a game config, expected a mapping at the top level")
+    for key, size in (("screen_size", 2), ("play_area", 4)):
+        value = raw.get(key)
+        if not (isinstance(value, list) and len(value) == size and all(isinstance(v, int) for v in value)):
+            errors.append(f"{key} should be a list of {size} ints, not {value!r}")
+
+    waves = raw.get("waves")
+    if not isinstance(waves, list) or not waves:
+        errors.append("waves should be a list of rows")
+    else:
+        for number, row in enumerate(waves, 1):
+            if not (isinstance(row, list) and len(row) == len(WAVE_COLUMNS)
+                    and all(isinstance(count, int) and count >= 0 for count in row)):
+                errors.append(f"wave {number} should be {len(WAVE_COLUMNS)} counts ({', '.join(WAVE_COLUMNS)}), "
+                              f"not {row!r}")
+
+    for name in ENEMIES:
+        section = raw.get(name)
+        if not isinstance(section, dict):
+            errors.append(f"{name} section is missing")
+            continue
+        for key, value in section.items():
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(v, (int, float)) for v in values):
+                errors.append(f"{name}.{key} should be numbers, not {value!r}")
+            elif key in RANGE_KEYS and isinstance(value, list) and not (len(value) == 2 and value[0] <= value[1]):
+                errors.append(f"{name}.{key} should be a [low, high] range, not {value!r}")
+
+    if errors:
+        raise ValueError(f"Invalid game config {path}:\n  " + "\n  ".join(errors))
+
+
+def private_dir(directory: str) -> bool:
+    """
+    Create directory readable only by this user if it doesn't exist, and whether it is owned by this user with no
+    group or other write access
+    """
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        status = os.stat(directory)
+    except OSError:
+        return False
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+def compile_config(path: str, cache_dir: Optional[str] = CACHE_DIR) -> GameConfig:
+    """
+    The GameConfig of a config file. The YAML is only parsed and validated the first time a file's contents are
+    seen: the result is kept in this process and the parts GameConfig reads are written to cache_dir as JSON under
+    the file's hash, which later processes load and validate instead. The recorded hash only catches stale files,
+    it proves nothing about who wrote them, so cache_dir is only used when it belongs to this user and nobody else
+    can write to it (it is created 0700). Pass the GameConfig itself to this repo's worker processes to skip even
+    that. RobotronEnv only takes config_path and reads the YAML itself, which is up to the robotron2084gym submodule.
+    """
+    with open(path, "rb") as f:
+        contents = f.read()
+    file_hash = hashlib.sha256(contents).hexdigest()
+    if file_hash in COMPILED:
+        return COMPILED[file_hash]
+
+    cache_path = None
+    if cache_dir and private_dir(cache_dir):
+        cache_path = os.path.join(cache_dir, f"game_config_v{CACHE_VERSION}_{file_hash}.json")
+    config = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["file_hash"] == file_hash:
+                validate(cached["config"], cache_path)
+                config = GameConfig(path, file_hash, cached["config"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # unreadable, invalid or not written by this version, parse the YAML instead
+            config = None
+    if config is None:
+        raw = yaml.safe_load(contents)
+        validate(raw, path)
+        config = GameConfig(path, file_hash, raw)
+        if cache_path:
+            tmp_path = f"{cache_path}.tmp{os.getpid()}"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump({"file_hash": file_hash, "config": {key: raw.get(key) for key in GameConfig.KEYS}}, f)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # only slower next time, e.g. a read-only home directory
+                pass
+
+    COMPILED[file_hash] = config
+    return config
+
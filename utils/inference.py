@@ -0,0 +1,236 @@
+import ctypes
+import multiprocessing
+import os
+import time
+import zipfile
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from sb3_contrib import QRDQN
+from stable_baselines3 import PPO
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.preprocessing import maybe_transpose
+from stable_baselines3.common.save_util import json_to_data
+
+from .checkpoint import MODEL_FILE
+
+MODEL_CLASSES = {"ppo": PPO, "qrdqn": QRDQN}
+
+# one byte messages, the observations and actions themselves are in shared memory
+REQUEST = b"r"
+REPLY = b"a"
+CLOSE = b"c"
+
+
+def model_file(path: str) -> str:
+    """
+    The model zip of a checkpoint directory, or path itself when it is already a zip
+    """
+    return os.path.join(path, MODEL_FILE) if os.path.isdir(path) else path
+
+
+def saved_data(path: str) -> Dict[str, Any]:
+    """
+    The attributes saved with a model, spaces and num_timesteps included, without loading its weights
+    """
+    with zipfile.ZipFile(model_file(path)) as archive:
+        return json_to_data(archive.read("data").decode())
+
+
+def saved_spaces(path: str) -> Tuple[spaces.Space, spaces.Space]:
+    """
+    (observation_space, action_space) of a saved model
+    """
+    data = saved_data(path)
+    return data["observation_space"], data["action_space"]
+
+
+def load_model(path: str, model_name: str, device: str = "cpu") -> BaseAlgorithm:
+    """
+    Load a model zip or checkpoint directory to play with: no env, and an off-policy model gets a one-slot plain
+    replay buffer instead of the one it trained with.
+    """
+    return MODEL_CLASSES[model_name].load(model_file(path), device=device, custom_objects={
+        "buffer_size": 1,
+        "replay_buffer_class": None,
+        "replay_buffer_kwargs": {},
+    })
+
+
+def slot_views(buffer, slots: int, space: spaces.Space) -> np.ndarray:
+    """
+    The first slots (space.shape) arrays in a shared buffer
+    """
+    return np.frombuffer(buffer, dtype=space.dtype, count=slots * int(np.prod(space.shape))).reshape(
+        (slots,) + space.shape)
+
+
+def slot_buffer(slots: int, space: spaces.Space):
+    """
+    Shared memory for slots (space.shape) arrays, read with slot_views
+    """
+    return multiprocessing.RawArray(ctypes.c_uint8, slots * int(np.prod(space.shape)) * space.dtype.itemsize)
+
+
+class InferenceClient:
+    """
+    One worker's handle on an InferenceServer, from InferenceServer.client(). Only one worker may use it.
+    """
+
+    def __init__(self, conn: Connection, obs_buffer, action_buffer, index: int, observation_space: spaces.Space,
+                 action_space: spaces.Space):
+        self.conn = conn
+        self.obs_buffer = obs_buffer
+        self.action_buffer = action_buffer
+        self.index = index
+        self.observation_space = observation_space
+        self.action_space = action_space
+        # views are made in the worker, the buffers are only shared once they get there
+        self.obs = None
+        self.action = None
+
+    def predict(self, observation: np.ndarray) -> np.ndarray:
+        """
+        The model's action for one observation, not a batch. Image observations may be channels last like the env
+        gives them, they are transposed the way SB3 does.
+        """
+        if self.obs is None:
+            self.obs = slot_views(self.obs_buffer, self.index + 1, self.observation_space)[self.index]
+            self.action = slot_views(self.action_buffer, self.index + 1, self.action_space)[self.index]
+        np.copyto(self.obs, maybe_transpose(np.asarray(observation), self.observation_space))
+        self.conn.send_bytes(REQUEST)
+        self.conn.recv_bytes()
+        return self.action.copy()
+
+    def close(self) -> None:
+        """
+        Leave the server, so it stops waiting for this worker's requests
+        """
+        if not self.conn.closed:
+            self.conn.send_bytes(CLOSE)
+            self.conn.close()
+
+
+def serve(model_path: str, model_name: str, device: str, deterministic: bool, threads: int, max_batch: int,
+          max_wait: float, conns: list, control: Connection, obs_buffer, action_buffer, stats) -> None:
+    """
+    InferenceServer's process: batch requests until every client has closed or the control pipe says to stop
+    """
+    th.set_num_threads(threads)
+    model = load_model(model_path, model_name, device)
+    policy = model.policy
+    policy.set_training_mode(False)
+    observations = slot_views(obs_buffer, len(conns), model.observation_space)
+    actions = slot_views(action_buffer, len(conns), model.action_space)
+    clients = {conn: index for index, conn in enumerate(conns)}
+    control.send_bytes(REPLY)
+
+    while clients:
+        pending = {}
+        ready = wait(list(clients) + [control])
+        deadline = time.perf_counter() + max_wait
+        while True:
+            for conn in ready:
+                if conn is control:
+                    return
+                try:
+                    message = conn.recv_bytes()
+                except EOFError:
+                    message = CLOSE
+                if message == CLOSE:
+                    del clients[conn]
+                    conn.close()
+                else:
+                    pending[conn] = clients[conn]
+            # run as soon as there is nobody left to wait for
+            if len(pending) >= min(max_batch, len(clients)):
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            ready = wait([conn for conn in clients if conn not in pending] + [control], remaining)
+            if not ready:
+                break
+
+        if pending:
+            batch = np.fromiter(pending.values(), dtype=np.intp, count=len(pending))
+            actions[batch] = policy.predict(observations[batch], deterministic=deterministic)[0]
+            stats[0] += len(batch)
+            stats[1] += 1
+            for conn in pending:
+                conn.send_bytes(REPLY)
+
+
+class InferenceServer:
+    """
+    Play a saved model for many env worker processes from one process that loads it once.
+
+    Each client gets a slot in shared memory for one observation and one action, and a pipe to signal on. A client
+    writes its observation and sends a request. The server waits for the first request, then up to max_wait seconds
+    for more, up to max_batch or until every client is waiting, and answers them all with one batched forward pass.
+    Observations never go through the pipes, so a request costs two one-byte messages whatever its size.
+
+    Start the server, hand client(i) to worker process i as a Process argument, and stop it when done, or use it as
+    a context manager. Clients leave by closing, the server stops by itself once all of them have.
+    """
+
+    def __init__(self, model_path: str, model_name: str, num_clients: int, max_batch: Optional[int] = None,
+                 max_wait: float = 0.002, device: str = "cpu", deterministic: bool = True, threads: int = 1):
+        self.observation_space, self.action_space = saved_spaces(model_path)
+        self.num_clients = num_clients
+        self.obs_buffer = slot_buffer(num_clients, self.observation_space)
+        self.action_buffer = slot_buffer(num_clients, self.action_space)
+        # requests answered, batches run
+        self.stats_buffer = multiprocessing.RawArray(ctypes.c_int64, 2)
+
+        pipes = [multiprocessing.Pipe() for _ in range(num_clients)]
+        self.server_conns = [server for server, _ in pipes]
+        self.client_conns = [client for _, client in pipes]
+        self.control, server_control = multiprocessing.Pipe()
+        self.server_control = server_control
+        self.process = multiprocessing.Process(
+            target=serve, daemon=True,
+            args=(model_path, model_name, device, deterministic, threads, max_batch or num_clients, max_wait,
+                  self.server_conns, server_control, self.obs_buffer, self.action_buffer, self.stats_buffer))
+
+    def client(self, index: int) -> InferenceClient:
+        return InferenceClient(self.client_conns[index], self.obs_buffer, self.action_buffer, index,
+                               self.observation_space, self.action_space)
+
+    def start(self) -> "InferenceServer":
+        """
+        Start the server process and wait for it to load the model
+        """
+        self.process.start()
+        # only the server process uses these now, closing them here lets it see when this process goes away
+        for conn in self.server_conns + [self.server_control]:
+            conn.close()
+        try:
+            self.control.recv_bytes()
+        except EOFError:
+            raise RuntimeError(f"Inference server failed to start, exit code {self.process.exitcode}") from None
+        return self
+
+    def stop(self, timeout: float = 10) -> None:
+        if self.process.is_alive():
+            try:
+                self.control.send_bytes(CLOSE)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+
+    def stats(self) -> Dict[str, float]:
+        requests, batches = self.stats_buffer
+        return {"requests": requests, "batches": batches, "mean_batch": requests / batches if batches else 0.0}
+
+    def __enter__(self) -> "InferenceServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,124 @@
+from typing import Sequence, Tuple
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.spaces import Box
+
+OBSERVATION_PIXELS = "pixels"
+OBSERVATION_OBJECTS = "objects"
+OBSERVATIONS = (OBSERVATION_PIXELS, OBSERVATION_OBJECTS)
+
+# Same groups as the robotron_fsm categories, plus the player's own bullets. The Player itself is not an object slot.
+OBJECT_CATEGORIES = [
+    ('TankShell', 'CruiseMissile', 'EnforcerBullet', 'Prog'),
+    ('Enforcer', 'Tank'),
+    ('Sphereoid', 'Quark'),
+    ('Grunt', 'Brain'),
+    ('Hulk',),
+    ('Electrode',),
+    ('Mommy', 'Daddy', 'Mikey'),
+    ('Bullet',),
+]
+# type ids for the encoder's own lookup tables, anything else the env sends gets UNKNOWN_TYPE
+TYPE_IDS = {name: type_id for type_id, name in enumerate(['Player'] + [name for types in OBJECT_CATEGORIES
+                                                                         for name in types])}
+UNKNOWN_TYPE = len(TYPE_IDS)
+PLAYER_TYPE = TYPE_IDS['Player']
+# present, dx, dy, distance, then a one-hot of the type within its category
+SLOT_FEATURES = 4 + max(len(types) for types in OBJECT_CATEGORIES)
+# player present, player x, player y
+GLOBAL_FEATURES = 3
+
+
+class ObjectStateEncoder:
+    """
+    Encode an env object list as a fixed-size float32 vector, instead of rendering and preprocessing pixels.
+
+    Each category in OBJECT_CATEGORIES gets per_category slots holding its nearest objects to the player, nearest
+    first. A slot is present (1 or 0), dx and dy from the player over the board width and height, distance over the
+    board diagonal, and a one-hot of which type in the category it is. Empty slots are all zeros. The vector starts
+    with whether the player is on the board and its position over the board size; when it isn't, distances are from
+    where it was last seen.
+    """
+
+    def __init__(self, board_size: Tuple[int, int], per_category: int = 8):
+        self.width, self.height = board_size
+        self.diagonal = float(np.hypot(self.width, self.height))
+        self.per_category = per_category
+        self.category_of = np.full(UNKNOWN_TYPE + 1, -1, dtype=np.intp)
+        self.index_in_category = np.zeros(UNKNOWN_TYPE + 1, dtype=np.intp)
+        for category, types in enumerate(OBJECT_CATEGORIES):
+            for index, name in enumerate(types):
+                self.category_of[TYPE_IDS[name]] = category
+                self.index_in_category[TYPE_IDS[name]] = index
+
+        self.size = GLOBAL_FEATURES + len(OBJECT_CATEGORIES) * per_category * SLOT_FEATURES
+        self.reset()
+
+    def reset(self) -> None:
+        self.player_x = self.width / 2
+        self.player_y = self.height / 2
+
+    def __call__(self, object_list: Sequence[Tuple[int, int, str]]) -> np.ndarray:
+        # a new array every time, VecEnvs keep the terminal observation after resetting the env
+        out = np.zeros(self.size, dtype=np.float32)
+        slots = out[GLOBAL_FEATURES:].reshape(-1, SLOT_FEATURES)
+        if len(object_list):
+            xs, ys, names = zip(*object_list)
+        else:
+            xs = ys = names = ()
+        xs = np.array(xs, dtype=np.float64)
+        ys = np.array(ys, dtype=np.float64)
+        types = np.array([TYPE_IDS.get(name, UNKNOWN_TYPE) for name in names], dtype=np.intp)
+
+        players = np.flatnonzero(types == PLAYER_TYPE)
+        if len(players):
+            self.player_x = xs[players[0]]
+            self.player_y = ys[players[0]]
+            out[0] = 1
+        out[1] = self.player_x / self.width
+        out[2] = self.player_y / self.height
+
+        categories = self.category_of[types]
+        keep = np.flatnonzero(categories >= 0)
+        dx = xs[keep] - self.player_x
+        dy = ys[keep] - self.player_y
+        distance = np.hypot(dx, dy)
+        categories = categories[keep]
+
+        # nearest first within each category, then each object's rank in its category
+        order = np.lexsort((distance, categories))
+        categories = categories[order]
+        rank = np.arange(len(order)) - np.searchsorted(categories, categories)
+        kept = rank < self.per_category
+        order = order[kept]
+        rows = categories[kept] * self.per_category + rank[kept]
+
+        slots[rows, 0] = 1
+        slots[rows, 1] = dx[order] / self.width
+        slots[rows, 2] = dy[order] / self.height
+        slots[rows, 3] = distance[order] / self.diagonal
+        slots[rows, 4 + self.index_in_category[types[keep][order]]] = 1
+        return out
+
+
+class ObjectStateObservation(gym.Wrapper):
+    """
+    Replace the pixel observation with ObjectStateEncoder's encoding of info["data"]. The env only sends the
+    object list with a step, so the observation from reset is the encoding of whatever reset's info has, usually
+    an empty board.
+    """
+
+    def __init__(self, env: gym.Env, per_category: int = 8):
+        super().__init__(env)
+        self.encoder = ObjectStateEncoder(env.unwrapped.get_board_size(), per_category)
+        self.observation_space = Box(low=-1.0, high=1.0, shape=(self.encoder.size,), dtype=np.float32)
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        self.encoder.reset()
+        return self.encoder(info.get("data", ())), info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        return self.encoder(info["data"]), reward, terminated, truncated, info
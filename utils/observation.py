@@ -0,0 +1,76 @@
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import gymnasium as gym
+import numpy as np
+from gymnasium.spaces import Box
+
+from .game_config import compile_config
+
+# [top, left, bottom, right] of the play field in the 1280x720 frame, same as play_area in config.yaml
+PLAY_AREA = (116, 309, 608, 974)
+OBSERVATION_SHAPE = (123, 166)
+
+
+def load_play_area(config_path: Optional[str]) -> Tuple[int, int, int, int]:
+    """
+    play_area from a game config file, or PLAY_AREA when there is no config file
+    """
+    if not config_path:
+        return PLAY_AREA
+    return compile_config(config_path).play_area
+
+
+class PlayAreaPreprocessor:
+    """
+    Crop to the play area, grayscale and area-downsample in one stage. Replaces GrayScaleObservation +
+    ResizeObservation, which converted and resized the whole frame. The crop is a view, so only the play area
+    pixels are read, and the grayscale buffer is reused every call.
+
+    __call__ and process_batch return new arrays, since vec envs keep observations (terminal_observation) across
+    the reset that follows. process_into writes into a buffer the caller owns.
+    """
+
+    def __init__(self, play_area: Sequence[int] = PLAY_AREA, shape: Tuple[int, int] = OBSERVATION_SHAPE):
+        self.top, self.left, self.bottom, self.right = play_area
+        self.shape = tuple(shape)
+        self.gray = np.empty((self.bottom - self.top, self.right - self.left), dtype=np.uint8)
+
+    def process_into(self, frame: np.ndarray, out: np.ndarray) -> np.ndarray:
+        crop = frame[self.top:self.bottom, self.left:self.right]
+        cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        # dsize is (width, height)
+        cv2.resize(self.gray, self.shape[::-1], dst=out[..., 0], interpolation=cv2.INTER_AREA)
+        return out
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """
+        One RGB frame (720, 1280, 3) to (123, 166, 1) uint8
+        """
+        return self.process_into(frame, np.empty(self.shape + (1,), dtype=np.uint8))
+
+    def process_batch(self, frames: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        A batch of RGB frames (N, 720, 1280, 3), e.g. every env of a vec env, to (N, 123, 166, 1) uint8, in out
+        when given
+        """
+        if out is None:
+            out = np.empty((len(frames),) + self.shape + (1,), dtype=np.uint8)
+        for frame, frame_out in zip(frames, out):
+            self.process_into(frame, frame_out)
+        return out
+
+
+class PlayAreaObservation(gym.ObservationWrapper):
+    """
+    Observation wrapper around PlayAreaPreprocessor, with the same observation space GrayScaleObservation(keep_dim=True)
+    + ResizeObservation((123, 166)) had.
+    """
+
+    def __init__(self, env: gym.Env, play_area: Sequence[int] = PLAY_AREA, shape: Tuple[int, int] = OBSERVATION_SHAPE):
+        super().__init__(env)
+        self.preprocessor = PlayAreaPreprocessor(play_area, shape)
+        self.observation_space = Box(low=0, high=255, shape=tuple(shape) + (1,), dtype=np.uint8)
+
+    def observation(self, observation: np.ndarray) -> np.ndarray:
+        return self.preprocessor(observation)
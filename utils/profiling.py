@@ -0,0 +1,169 @@
+import json
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import gymnasium as gym
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvStepReturn, VecEnvWrapper
+
+# info key the per-env timers report in, seconds per stage for that step
+STAGE_TIMES_KEY = "stage_times"
+PERCENTILES = (50, 90, 99)
+
+
+class StageProfiler:
+    """
+    Collects how long each stage of the training loop takes, in seconds.
+
+    Stages timed with timed() can nest, and each one only counts its own time, without the stages timed inside it,
+    so the stages of one process add up to at most the wall time.
+    """
+
+    def __init__(self):
+        self.times: Dict[str, List[float]] = defaultdict(list)
+        self.child_time = 0.0
+
+    def add(self, name: str, seconds: float) -> None:
+        self.times[name].append(seconds)
+
+    def timed(self, name: str, fn: Callable, *args, **kwargs) -> Any:
+        outer_child_time = self.child_time
+        self.child_time = 0.0
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name].append(elapsed - self.child_time)
+            self.child_time = outer_child_time + elapsed
+
+    def wrap(self, obj: Any, method: str, name: str) -> Any:
+        """
+        Time every call to obj.method as stage name, by shadowing it on the instance. Returns obj.
+        """
+        fn = getattr(obj, method)
+        setattr(obj, method, lambda *args, **kwargs: self.timed(name, fn, *args, **kwargs))
+        return obj
+
+    def summary(self, wall_time: float) -> Dict[str, Dict[str, float]]:
+        """
+        Per stage: calls, total seconds, share of wall_time and percentiles of one call in ms
+        """
+        stages = {}
+        for name, times in self.times.items():
+            if not times:
+                continue
+            times = np.array(times)
+            stage = {"calls": len(times), "total_s": float(times.sum()), "share": float(times.sum() / wall_time)}
+            for percentile, value in zip(PERCENTILES, np.percentile(times, PERCENTILES)):
+                stage[f"p{percentile}_ms"] = float(value * 1000)
+            stages[name] = stage
+        return stages
+
+    def clear(self) -> None:
+        for times in self.times.values():
+            times.clear()
+
+
+class EnvStageTimer(gym.Wrapper):
+    """
+    Time each step of the wrapped env, minus stages already timed inside it, and report it as
+    info["stage_times"][name]. Works in SubprocVecEnv workers, the times come back with the infos.
+    """
+
+    def __init__(self, env: gym.Env, name: str):
+        super().__init__(env)
+        self.name = name
+
+    def step(self, action):
+        start = time.perf_counter()
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        elapsed = time.perf_counter() - start
+        stage_times = info.setdefault(STAGE_TIMES_KEY, {})
+        stage_times[self.name] = elapsed - sum(stage_times.values())
+        return obs, reward, terminated, truncated, info
+
+
+class VecStageTimer(VecEnvWrapper):
+    """
+    Time step_wait of everything below this wrapper, down to the next VecStageTimer, as stage name
+    """
+
+    def __init__(self, venv: VecEnv, profiler: StageProfiler, name: str):
+        super().__init__(venv)
+        self.profiler = profiler
+        self.name = name
+
+    def reset(self):
+        return self.venv.reset()
+
+    def step_wait(self) -> VecEnvStepReturn:
+        return self.profiler.timed(self.name, self.venv.step_wait)
+
+
+class ThroughputCallback(BaseCallback):
+    """
+    Every interval steps, log samples/sec and the time each stage took since the last report to the SB3 logger
+    under throughput/, and as a JSON line to log_path when it is set.
+
+    Stages in this process are timed by VecStageTimers and by wrapping the model's policy inference ("policy"),
+    gradient updates ("train") and log writing ("logging"). Stages in env workers come from EnvStageTimers, and run
+    in parallel with each other and with the "vec_env" wait, so their share is per env.
+    """
+
+    def __init__(self, profiler: StageProfiler, interval: int = 1000, log_path: Optional[str] = None, verbose: int = 0):
+        super().__init__(verbose)
+        self.profiler = profiler
+        self.interval = interval
+        self.log_path = log_path
+        self.env_stages = StageProfiler()
+        self.start_time = None
+        self.start_timesteps = 0
+
+    def _init_callback(self) -> None:
+        self.profiler.wrap(self.model, "predict", "policy")
+        self.profiler.wrap(self.model.policy, "forward", "policy")
+        self.profiler.wrap(self.model, "train", "train")
+        self.profiler.wrap(self.model.logger, "dump", "logging")
+
+    def _on_training_start(self) -> None:
+        self.profiler.clear()
+        self.start_time = time.perf_counter()
+        self.start_timesteps = self.model.num_timesteps
+
+    def _on_step(self) -> bool:
+        for info in self.locals.get("infos", ()):
+            for name, seconds in info.get(STAGE_TIMES_KEY, {}).items():
+                self.env_stages.add(name, seconds)
+        if self.n_calls % self.interval == 0:
+            self.report()
+        return True
+
+    def report(self) -> None:
+        now = time.perf_counter()
+        wall_time = now - self.start_time
+        samples_per_sec = (self.num_timesteps - self.start_timesteps) / wall_time
+        stages = self.profiler.summary(wall_time)
+        # each env's steps take up the whole wall time between them
+        env_stages = self.env_stages.summary(wall_time * self.training_env.num_envs)
+
+        self.logger.record("throughput/samples_per_sec", samples_per_sec)
+        for name, stage in {**stages, **env_stages}.items():
+            self.logger.record(f"throughput/{name}_share", stage["share"])
+            for percentile in PERCENTILES:
+                self.logger.record(f"throughput/{name}_p{percentile}_ms", stage[f"p{percentile}_ms"])
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({"timesteps": self.num_timesteps, "wall_time": wall_time,
+                                    "samples_per_sec": samples_per_sec, "stages": stages,
+                                    "env_stages": env_stages}) + "\n")
+        if self.verbose:
+            breakdown = ", ".join(f"{name} {stage['share']:.0%}" for name, stage in stages.items())
+            print(f"{samples_per_sec:.0f} samples/sec: {breakdown}")
+
+        self.profiler.clear()
+        self.env_stages.clear()
+        self.start_time = now
+        self.start_timesteps = self.num_timesteps
@@ -0,0 +1,250 @@
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+
+class FrameStackReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer for VecFrameStack observations that stores every frame once.
+
+    A stacked observation is the last frame_stack frames, and the next observation is the same stack shifted by one
+    new frame, so a plain ReplayBuffer keeps each frame up to 2 * frame_stack times. This buffer keeps only the newest
+    frame of each observation, one per step, and rebuilds both stacks from the steps before it when sampling.
+    Frames from before the start of an episode are zeros, the same as VecFrameStack pads them. The terminal frame of
+    an episode is not the first frame of the next one, so those are kept separately.
+
+    Transitions whose earlier frames have already been overwritten, or whose next frame hasn't been added yet,
+    are never sampled.
+
+    :param frame_stack: frames per observation, same as VecFrameStack n_stack
+    :param stack_axis: observation axis the frames are stacked along, without the env axis.
+        None finds the first axis that is a multiple of frame_stack.
+    :param memmap_dir: keep the frames in a memory-mapped file in this directory instead of in RAM.
+        The file is unlinked right away, so it goes away with the buffer.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Space,
+        device: Union[th.device, str] = "auto",
+        n_envs: int = 1,
+        optimize_memory_usage: bool = False,
+        handle_timeout_termination: bool = True,
+        frame_stack: int = 4,
+        stack_axis: Optional[int] = None,
+        memmap_dir: Optional[str] = None,
+    ):
+        # skip ReplayBuffer.__init__, it allocates the full observations and next_observations arrays
+        BaseBuffer.__init__(self, buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = False
+        self.handle_timeout_termination = handle_timeout_termination
+
+        self.frame_stack = frame_stack
+        if stack_axis is None:
+            stack_axis = next(axis for axis, size in enumerate(self.obs_shape) if size % frame_stack == 0)
+        self.stack_axis = stack_axis
+        frame_shape = list(self.obs_shape)
+        frame_shape[stack_axis] //= frame_stack
+        self.frame_shape = tuple(frame_shape)
+        frame_height = self.frame_shape[stack_axis]
+        # newest frame of an (n_envs, *obs_shape) batch
+        self.last_frame = (slice(None),) * (1 + stack_axis) + (slice((frame_stack - 1) * frame_height, None),)
+
+        frames_shape = (self.buffer_size, self.n_envs) + self.frame_shape
+        self.memmap_dir = memmap_dir
+        if memmap_dir:
+            os.makedirs(memmap_dir, exist_ok=True)
+            fd, frames_path = tempfile.mkstemp(prefix="replay_frames_", suffix=".npy", dir=memmap_dir)
+            os.close(fd)
+            self.frames = np.lib.format.open_memmap(frames_path, mode="w+", dtype=observation_space.dtype,
+                                                    shape=frames_shape)
+            os.unlink(frames_path)
+        else:
+            self.frames = np.zeros(frames_shape, dtype=observation_space.dtype)
+
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim),
+                                dtype=self._maybe_cast_dtype(action_space.dtype))
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+        # steps since the episode started, capped at frame_stack, and whether the frames before them are known
+        self.episode_steps = np.zeros((self.buffer_size, self.n_envs), dtype=np.int16)
+        self.history_known = np.zeros((self.buffer_size, self.n_envs), dtype=bool)
+        # (slot, env): newest frame of the terminal observation
+        self.terminal_frames: Dict[tuple, np.ndarray] = {}
+        self.reset_episodes()
+
+    def reset_episodes(self) -> None:
+        self.env_steps = np.full(self.n_envs, -1, dtype=np.int64)
+        self.env_history_known = np.zeros(self.n_envs, dtype=bool)
+        self.env_done = np.ones(self.n_envs, dtype=bool)
+
+    def reset(self) -> None:
+        super().reset()
+        self.terminal_frames.clear()
+        self.reset_episodes()
+
+    def add(
+        self,
+        obs: np.ndarray,
+        next_obs: np.ndarray,
+        action: np.ndarray,
+        reward: np.ndarray,
+        done: np.ndarray,
+        infos: List[Dict[str, Any]],
+    ) -> None:
+        pos = self.pos
+        for env in range(self.n_envs):
+            self.terminal_frames.pop((pos, env), None)
+
+        """ a stack continues the last one unless the last step ended the episode """
+        for env in range(self.n_envs):
+            if self.env_done[env]:
+                self.env_steps[env] = 0
+                # VecFrameStack pads a fresh episode with zeros, so all-zero older frames means it just started
+                older = np.asarray(obs[env]).take(range(self.obs_shape[self.stack_axis] - self.frame_shape[self.stack_axis]),
+                                                  axis=self.stack_axis)
+                self.env_history_known[env] = not older.any()
+            else:
+                self.env_steps[env] += 1
+        self.episode_steps[pos] = np.minimum(self.env_steps, self.frame_stack)
+        self.history_known[pos] = self.env_history_known | (self.env_steps >= self.frame_stack - 1)
+
+        self.frames[pos] = np.asarray(obs)[self.last_frame]
+        done = np.asarray(done)
+        for env in np.flatnonzero(done):
+            self.terminal_frames[(pos, env)] = np.array(np.asarray(next_obs)[self.last_frame][env])
+        self.env_done = done.astype(bool)
+
+        self.actions[pos] = np.array(action).reshape((self.n_envs, self.action_dim))
+        self.rewards[pos] = np.array(reward)
+        self.dones[pos] = done
+        if self.handle_timeout_termination:
+            self.timeouts[pos] = np.array([info.get("TimeLimit.truncated", False) for info in infos])
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def state_dict(self) -> Dict[str, np.ndarray]:
+        """
+        Everything needed to rebuild the buffer, as arrays, for checkpoints
+        """
+        terminal = sorted(self.terminal_frames)
+        return {
+            "frames": self.frames,
+            "actions": self.actions,
+            "rewards": self.rewards,
+            "dones": self.dones,
+            "timeouts": self.timeouts,
+            "episode_steps": self.episode_steps,
+            "history_known": self.history_known,
+            "terminal_keys": np.array(terminal, dtype=np.int64).reshape(-1, 2),
+            "terminal_frames": np.array([self.terminal_frames[key] for key in terminal],
+                                        dtype=self.frames.dtype).reshape((-1,) + self.frame_shape),
+            "pos": np.array(self.pos),
+            "full": np.array(self.full),
+        }
+
+    def load_state_dict(self, state: Dict[str, np.ndarray], stale_slots: int = 0) -> None:
+        """
+        Restore a state_dict into this buffer. "frames" may be left out if they were already copied into self.frames.
+
+        The envs are reset after a restore, so episodes are cut off with end_episodes(). stale_slots is how many of
+        the oldest slots were refilled after the snapshot was taken, when the frames are memory-mapped and were read
+        while training went on; transitions that use them are dropped too.
+        """
+        if state["actions"].shape != self.actions.shape:
+            raise ValueError(f"Replay buffer checkpoint has shape {state['actions'].shape[:2]}, "
+                             f"expected (buffer_size, n_envs) = {self.actions.shape[:2]}")
+        if "frames" in state:
+            self.frames[:] = state["frames"]
+        for name in ("actions", "rewards", "dones", "timeouts", "episode_steps", "history_known"):
+            getattr(self, name)[:] = state[name]
+        self.terminal_frames = {(int(pos), int(env)): np.array(frame)
+                                for (pos, env), frame in zip(state["terminal_keys"], state["terminal_frames"])}
+        self.pos = int(state["pos"])
+        self.full = bool(state["full"])
+
+        if stale_slots:
+            stale = (self.pos + np.arange(min(stale_slots + self.frame_stack - 1, self.buffer_size))) % self.buffer_size
+            self.history_known[stale] = False
+        self.end_episodes()
+
+    def end_episodes(self) -> None:
+        """
+        Cut every episode off here, for when the next add() won't continue them, e.g. the envs were reset.
+        The last step of each unfinished episode has no next frame, so it is never sampled.
+        """
+        if self.pos or self.full:
+            newest = (self.pos - 1) % self.buffer_size
+            self.history_known[newest] &= self.dones[newest] > 0
+        self.reset_episodes()
+
+    def valid(self, batch_inds: np.ndarray, env_indices: np.ndarray) -> np.ndarray:
+        """
+        Transitions that can be rebuilt: earlier frames still in the buffer, and a next frame to go with them
+        """
+        steps = self.episode_steps[batch_inds, env_indices]
+        valid = self.history_known[batch_inds, env_indices].copy()
+        newest = (self.pos - 1) % self.buffer_size
+        valid &= (batch_inds != newest) | (self.dones[batch_inds, env_indices] > 0)
+        if self.full:
+            age = (batch_inds - self.pos) % self.buffer_size
+            valid &= np.minimum(steps, self.frame_stack - 1) <= age
+        return valid
+
+    def sample(self, batch_size: int, env: Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        upper_bound = self.buffer_size if self.full else self.pos
+        batch_inds = np.random.randint(0, upper_bound, size=batch_size)
+        env_indices = np.random.randint(0, self.n_envs, size=batch_size)
+        for _ in range(100):
+            invalid = np.flatnonzero(~self.valid(batch_inds, env_indices))
+            if not invalid.size:
+                return self._get_samples(batch_inds, env, env_indices)
+            batch_inds[invalid] = np.random.randint(0, upper_bound, size=invalid.size)
+            env_indices[invalid] = np.random.randint(0, self.n_envs, size=invalid.size)
+        raise ValueError("Not enough complete transitions in the replay buffer to sample from")
+
+    def stack(self, frames: np.ndarray) -> np.ndarray:
+        """
+        (batch, frame_stack, *frame_shape) to (batch, *obs_shape), oldest frame first like VecFrameStack
+        """
+        frames = np.moveaxis(frames, 1, 1 + self.stack_axis)
+        return frames.reshape((len(frames),) + self.obs_shape)
+
+    def _get_samples(self, batch_inds: np.ndarray, env: Optional[VecNormalize] = None,
+                     env_indices: Optional[np.ndarray] = None) -> ReplayBufferSamples:
+        if env_indices is None:
+            env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        lookback = np.arange(self.frame_stack - 1, -1, -1)
+        steps = self.episode_steps[batch_inds, env_indices]
+        envs = env_indices[:, None]
+
+        obs_frames = self.frames[(batch_inds[:, None] - lookback) % self.buffer_size, envs]
+        obs_frames[lookback > steps[:, None]] = 0
+        next_frames = self.frames[(batch_inds[:, None] + 1 - lookback) % self.buffer_size, envs]
+        next_frames[lookback > steps[:, None] + 1] = 0
+        for sample in np.flatnonzero(self.dones[batch_inds, env_indices]):
+            next_frames[sample, -1] = self.terminal_frames[(batch_inds[sample], env_indices[sample])]
+
+        data = (
+            self._normalize_obs(self.stack(obs_frames), env),
+            self.actions[batch_inds, env_indices, :],
+            self._normalize_obs(self.stack(next_frames), env),
+            (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+        )
+        return ReplayBufferSamples(*tuple(map(self.to_torch, data)))
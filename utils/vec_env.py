@@ -0,0 +1,85 @@
+from typing import Callable, List, Optional, Sequence
+
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+from robotron2084gym.robotron import RobotronEnv
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv, VecFrameStack
+
+from .frame_skip import FrameSkip
+from .object_observation import OBSERVATION_OBJECTS, OBSERVATION_PIXELS, OBSERVATIONS, ObjectStateObservation
+from .observation import PlayAreaObservation, load_play_area
+from .profiling import EnvStageTimer
+
+
+def make_env(env_config: dict, level: Optional[int] = None, info_keywords: Sequence[str] = (),
+             frame_skip: int = 1, stage_timing: bool = False,
+             observation: str = OBSERVATION_PIXELS) -> Callable[[], gym.Env]:
+    """
+    Return a function that builds one preprocessed RobotronEnv, for DummyVecEnv or SubprocVecEnv.
+    Everything it captures is plain data, so it can be sent to a worker process and the env is built there.
+    frame_skip > 1 repeats each action for that many game frames, see FrameSkip.
+    stage_timing reports how long the game step and the preprocessing took in each info, see EnvStageTimer.
+    observation is OBSERVATION_PIXELS for the preprocessed play area, or OBSERVATION_OBJECTS for the object list
+    encoded as a vector, see ObjectStateObservation.
+    """
+    if observation not in OBSERVATIONS:
+        raise ValueError(f"Unknown observation {observation!r}, expected one of {OBSERVATIONS}")
+
+    # read here rather than in every worker process
+    play_area = load_play_area(env_config.get('config_path'))
+
+    def init() -> gym.Env:
+        config = dict(env_config)
+        if level is not None:
+            config['level'] = level
+        env = RobotronEnv(**config)
+        if frame_skip > 1:
+            # the object observation never reads the pixels
+            env = FrameSkip(env, frame_skip, max_pool=observation != OBSERVATION_OBJECTS)
+        if stage_timing:
+            env = EnvStageTimer(env, "env_step")
+        if observation == OBSERVATION_OBJECTS:
+            env = ObjectStateObservation(env)
+        else:
+            env = PlayAreaObservation(env, play_area)
+        if stage_timing:
+            env = EnvStageTimer(env, "preprocess")
+        env = Monitor(env, info_keywords=tuple(info_keywords))
+        return env
+
+    return init
+
+
+def make_vec_env(env_config: dict, num_envs: int = 1, seed: Optional[int] = None, levels: Optional[List[int]] = None,
+                 info_keywords: Sequence[str] = (), frame_skip: int = 1, stage_timing: bool = False,
+                 observation: str = OBSERVATION_PIXELS) -> VecEnv:
+    """
+    Build num_envs RobotronEnvs. One env steps in this process, more than one each get their own worker process.
+    Env i is seeded with seed + i, and starts on levels[i % len(levels)] when levels are given.
+    Env 0 is the one WandBVideoRecorderWrapper records.
+    """
+    env_fns = [make_env(env_config, levels[i % len(levels)] if levels else None, info_keywords, frame_skip,
+                        stage_timing, observation)
+               for i in range(num_envs)]
+    env = DummyVecEnv(env_fns) if num_envs == 1 else SubprocVecEnv(env_fns)
+    if seed is not None:
+        env.seed(seed)
+    return env
+
+
+def make_policy_env(env_config: dict, observation_space: spaces.Space, level: Optional[int] = None,
+                    frame_skip: int = 1, seed: Optional[int] = None) -> VecEnv:
+    """
+    One env in this process built the way train.py trains, for playing a saved model with observation_space:
+    object observations when it takes vectors, and as many frames stacked as its observations hold.
+    The frame skip isn't part of the model, so it has to be given.
+    """
+    observation = OBSERVATION_OBJECTS if len(observation_space.shape) == 1 else OBSERVATION_PIXELS
+    env = make_vec_env(env_config, seed=seed, levels=[level] if level is not None else None, frame_skip=frame_skip,
+                       observation=observation)
+    frame_stack = int(np.prod(observation_space.shape)) // int(np.prod(env.observation_space.shape))
+    if frame_stack > 1:
+        env = VecFrameStack(env, frame_stack, channels_order='first')
+    return env
@@ -1,23 +1,50 @@
-import os
-from typing import Callable
+import queue
+import threading
+from typing import Callable, Optional
+
+import cv2
 import numpy as np
 from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvObs, VecEnvStepReturn, VecEnvWrapper
 import wandb
 
+# Frame buffers: one filling while the other encodes and uploads
+VIDEO_BUFFERS = 2
+
 
 class WandBVideoRecorderWrapper(VecEnvWrapper):
-    def __init__(self, venv: VecEnv, record_video_trigger: Callable[[int], bool], video_length: int = 200, use_obs: bool = False):
+    """
+    Record env 0 to wandb every time record_video_trigger fires.
+
+    Frames are copied into a preallocated uint8 buffer, optionally downscaled by video_scale first. A finished video is
+    handed to a background thread for encoding, so recording costs the training loop one render and one copy per
+    step. Encoded videos are logged from the training thread on a later step, wandb.log isn't called from two
+    threads. If every buffer is still encoding when the next video should start, that video is skipped rather than
+    waited for.
+    """
+
+    def __init__(self, venv: VecEnv, record_video_trigger: Callable[[int], bool], video_length: int = 200, use_obs: bool = False,
+                 video_scale: float = 1.0, fps: int = 30):
         VecEnvWrapper.__init__(self, venv)
 
         self.env = venv
         self.use_obs = use_obs
         self.record_video_trigger = record_video_trigger
+        self.video_scale = video_scale
+        self.fps = fps
 
         self.step_id = 0
         self.recording = False
         self.recorded_frames = 0
         self.video_length = video_length
         self.frames = None
+        self.scaled = None
+
+        self.buffers_allocated = 0
+        self.free_buffers = queue.Queue()
+        self.uploads = queue.Queue()
+        self.encoded = queue.Queue()
+        self.uploader = threading.Thread(target=self.encode_videos, name="wandb-video-encode", daemon=True)
+        self.uploader.start()
 
     def reset(self) -> VecEnvObs:
         obs = self.venv.reset()
@@ -32,34 +59,93 @@ class WandBVideoRecorderWrapper(VecEnvWrapper):
     def _video_enabled(self) -> bool:
         return self.record_video_trigger(self.step_id)
 
+    def capture(self, obs) -> np.ndarray:
+        """
+        Env 0's frame as (H, W, C) uint8, downscaled when video_scale is set. Observations are never scaled.
+        """
+        if self.use_obs:
+            return obs[0]
+
+        # env 0 only, VecEnv.render would tile every env into one image
+        frame = self.venv.env_method('render', 'rgb_array', indices=0)[0]
+        if self.video_scale == 1.0:
+            return frame
+        if self.scaled is None:
+            height, width = frame.shape[:2]
+            self.scaled = np.empty((max(1, round(height * self.video_scale)), max(1, round(width * self.video_scale)))
+                                   + frame.shape[2:], dtype=np.uint8)
+        cv2.resize(frame, self.scaled.shape[1::-1], dst=self.scaled, interpolation=cv2.INTER_AREA)
+        return self.scaled
+
+    def take_buffer(self, frame_shape) -> Optional[np.ndarray]:
+        try:
+            return self.free_buffers.get_nowait()
+        except queue.Empty:
+            pass
+        if self.buffers_allocated < VIDEO_BUFFERS:
+            self.buffers_allocated += 1
+            height, width, channels = frame_shape
+            return np.empty((self.video_length + 1, channels, height, width), dtype=np.uint8)
+        return None
+
+    def log_videos(self) -> None:
+        """
+        Log the videos the background thread has finished encoding, from the thread that logs everything else
+        """
+        while True:
+            try:
+                video = self.encoded.get_nowait()
+            except queue.Empty:
+                return
+            wandb.log({"video": video})
+
     def save_frame(self, obs) -> None:
         if self.recording:
+            frame = self.capture(obs)
             if self.frames is None:
-                self.frames = []
-
-            if self.use_obs:
-                self.frames.append(obs[0].transpose(2, 0, 1))
-            else:
-                self.frames.append(self.env.render('rgb_array').transpose(2, 0, 1))
+                self.frames = self.take_buffer(frame.shape)
+                if self.frames is None:
+                    # every buffer is still uploading, skip this video rather than wait for one
+                    self.close_video_recorder()
+                    return
 
+            self.frames[self.recorded_frames] = frame.transpose(2, 0, 1)
             self.recorded_frames += 1
 
     def step_wait(self) -> VecEnvStepReturn:
         obs, rews, dones, infos = self.venv.step_wait()
         self.step_id += 1
+        if not self.encoded.empty():
+            self.log_videos()
         if self.recording:
             self.save_frame(obs)
 
             if self.recorded_frames > self.video_length:
-                frames = np.array(self.frames, dtype=np.uint8)
-                wandb.log({"video": wandb.Video(frames, fps=30)})
+                self.uploads.put((self.frames, self.recorded_frames))
+                self.frames = None
                 self.close_video_recorder()
         elif self._video_enabled():
             self.start_video_recorder(obs)
 
         return obs, rews, dones, infos
 
+    def encode_videos(self) -> None:
+        """
+        Background thread: encode finished videos for log_videos, then hand their buffers back
+        """
+        while True:
+            upload = self.uploads.get()
+            if upload is None:
+                break
+            frames, length = upload
+            try:
+                self.encoded.put(wandb.Video(frames[:length], fps=self.fps))
+            finally:
+                self.free_buffers.put(frames)
+
     def close_video_recorder(self) -> None:
+        if self.frames is not None:
+            self.free_buffers.put(self.frames)
         self.frames = None
         self.recording = False
         self.recorded_frames = 0
@@ -67,6 +153,11 @@ class WandBVideoRecorderWrapper(VecEnvWrapper):
     def close(self) -> None:
         VecEnvWrapper.close(self)
         self.close_video_recorder()
+        if self.uploader.is_alive():
+            # let videos already handed off finish encoding, and log them
+            self.uploads.put(None)
+            self.uploader.join()
+            self.log_videos()
 
     def __del__(self):
         self.close()